@@ -0,0 +1,54 @@
+# Copyright (c) 2016-2021 Adobe Inc.  All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Measure the cold-start cost of `import umapi_client`, each run in a fresh interpreter,
+and report whether the JWT libraries were loaded along with it.
+
+Usage: python benchmarks/import_time.py [runs]
+"""
+
+import statistics
+import subprocess
+import sys
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import umapi_client
+elapsed = time.perf_counter() - start
+print(elapsed, int('jwt' in sys.modules), int('cryptography' in sys.modules))
+"""
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", SCRIPT], check=True, capture_output=True, text=True).stdout
+        elapsed, jwt_loaded, crypto_loaded = out.split()
+        times.append(float(elapsed))
+    print("import umapi_client: median {:.1f} ms, min {:.1f} ms over {} runs".format(
+        statistics.median(times) * 1000, min(times) * 1000, runs))
+    print("jwt loaded: {}, cryptography loaded: {}".format(bool(int(jwt_loaded)), bool(int(crypto_loaded))))
+
+
+if __name__ == "__main__":
+    main()
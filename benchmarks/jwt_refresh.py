@@ -0,0 +1,56 @@
+# Copyright (c) 2016-2021 Adobe Inc.  All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Measure the client-side cost of building the JWT for a token refresh, comparing
+signing with the PEM text (parsed on every refresh) against the key object that
+JWTAuth parses once and reuses.
+
+Usage: python benchmarks/jwt_refresh.py [private-key-file] [refreshes]
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+import jwt
+
+from umapi_client import JWTAuth
+
+DEFAULT_KEY = Path(__file__).parent.parent / "tests" / "fixture" / "private.key"
+
+
+def main():
+    key_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_KEY
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    with open(key_file) as f:
+        auth = JWTAuth("org_id", "client_id", "client_secret", "tech_acct_id", f.read())
+
+    def sign_with_pem():
+        jwt.encode({"iss": auth.org_id}, auth.priv_key_data, algorithm="RS256")
+
+    for name, func in (("PEM parsed per refresh", sign_with_pem), ("cached key object", auth.jwt_token)):
+        func()
+        seconds = timeit.timeit(func, number=number)
+        print("{:<24} {:8.3f} ms per refresh".format(name, seconds * 1000 / number))
+
+
+if __name__ == "__main__":
+    main()
@@ -19,12 +19,14 @@
 # SOFTWARE.
 
 import json
+import threading
+import time
 
 import mock
 import pytest
 from conftest import MockResponse
 
-from umapi_client import Connection, Action, BatchError
+from umapi_client import Connection, Action, BatchError, UnavailableError, ServerError, ArgumentError
 
 
 def test_action_create():
@@ -316,3 +318,427 @@ def test_execute_multiple_queued_throttle_actions_error(mock_connection_params):
                                 "actions-sent": 6,
                                 "actions-completed": 4,
                                 "actions-queued": 0}
+
+
+def test_execute_multiple_in_flight(mock_connection_params):
+    # each call waits for the others, so this only succeeds if all three batches are sent together
+    barrier = threading.Barrier(3, timeout=5)
+
+    def post(*args, **kwargs):
+        barrier.wait()
+        return MockResponse(200, {"result": "success"})
+
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = post
+        conn = Connection(max_in_flight=3, **mock_connection_params)
+        conn.throttle_actions = 2
+        actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(6)]
+        assert conn.execute_multiple(actions) == (0, 6, 6)
+        assert mock_post.call_count == 3
+
+
+def test_execute_multiple_in_flight_request_ids(mock_connection_params):
+    # batches sent together in the same millisecond still get distinct request ids
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post, \
+            mock.patch("umapi_client.connection.datetime") as mock_datetime:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        mock_datetime.now.return_value.timestamp.return_value = 1600000000.0
+        conn = Connection(max_in_flight=3, **mock_connection_params)
+        conn.throttle_actions = 2
+        actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(6)]
+        assert conn.execute_multiple(actions) == (0, 6, 6)
+        request_ids = {c[1]["headers"]["X-Request-Id"] for c in mock_post.call_args_list}
+        assert len(request_ids) == 3
+        assert all(request_id.startswith(conn.uuid + "_1600000000000_") for request_id in request_ids)
+
+
+def test_execute_multiple_in_flight_error(mock_connection_params):
+    def post(*args, **kwargs):
+        body = json.loads(kwargs["data"])
+        if body[0]["top"] == "top2":
+            return MockResponse(500, text="500 test server failure")
+        if body[0]["top"] == "top4":
+            return MockResponse(200, {"result": "partial",
+                                      "completed": 1,
+                                      "notCompleted": 1,
+                                      "errors": [{"index": 1, "step": 0, "errorCode": "test"}]})
+        return MockResponse(200, {"result": "success"})
+
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = post
+        conn = Connection(max_in_flight=4, **mock_connection_params)
+        conn.throttle_actions = 2
+        actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(7)]
+        with pytest.raises(BatchError) as excinfo:
+            conn.execute_multiple(actions, immediate=False)
+        assert len(excinfo.value.causes) == 1
+        assert excinfo.value.statistics == (1, 6, 3)
+        assert actions[5].execution_errors() == [{"command": {"a": "a5"}, "target": {"top": "top5"}, "errorCode": "test"}]
+        local_status, _ = conn.status(remote=False)
+        assert local_status["actions-sent"] == 6
+        assert local_status["actions-completed"] == 3
+        assert local_status["actions-queued"] == 1
+
+
+def test_execute_multiple_requeue_throttled(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post, \
+            mock.patch("umapi_client.connection.sleep") as mock_sleep:
+        mock_post.side_effect = [MockResponse(200, {"result": "success"}),
+                                 MockResponse(429, headers={"Retry-After": "30"})]
+        conn = Connection(requeue_throttled=True, **mock_connection_params)
+        conn.throttle_actions = 2
+        actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(6)]
+        # the second batch is throttled, so it and the third go back on the queue without waiting
+        assert conn.execute_multiple(actions) == (4, 2, 2)
+        mock_sleep.assert_not_called()
+        assert mock_post.call_count == 2
+        assert conn.action_queue == actions[2:]
+        assert 29 < conn.queue_delay() <= 30
+        # nothing is sent until the wait is over
+        assert conn.execute_queued() == (4, 0, 0)
+        assert mock_post.call_count == 2
+        conn._queue_not_before = 0.0
+        mock_post.side_effect = None
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        assert conn.execute_queued() == (0, 4, 4)
+        local_status, _ = conn.status(remote=False)
+        assert local_status["actions-sent"] == 6
+        assert local_status["actions-completed"] == 6
+
+
+def test_execute_multiple_requeue_throttled_in_flight(mock_connection_params):
+    def post(*args, **kwargs):
+        if json.loads(kwargs["data"])[0]["top"] == "top2":
+            return MockResponse(429, headers={"Retry-After": "10"})
+        return MockResponse(200, {"result": "success"})
+
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = post
+        conn = Connection(requeue_throttled=True, max_in_flight=3, **mock_connection_params)
+        conn.throttle_actions = 2
+        actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(7)]
+        queued, sent, completed = conn.execute_multiple(actions, immediate=False)
+        assert conn.action_queue[0:2] == actions[2:4]
+        assert conn.action_queue[-1] == actions[6]
+        assert queued + sent == 7
+        assert sent == completed
+
+
+def test_execute_multiple_coalesce(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "partial",
+                                                    "completed": 1,
+                                                    "notCompleted": 1,
+                                                    "errors": [{"index": 0, "step": 2,
+                                                                "errorCode": "test.error"}]})
+        conn = Connection(coalesce_actions=True, **mock_connection_params)
+        action0 = Action(top="top0").append(a="a0").append(b="b0")
+        action1 = Action(top="top1").append(a="a1")
+        action2 = Action(top="top0").append(c="c0")
+        assert conn.execute_multiple([action0, action1, action2]) == (0, 2, 1)
+        body = json.loads(mock_post.call_args[1]["data"])
+        assert body == [{"top": "top0", "do": [{"a": "a0"}, {"b": "b0"}, {"c": "c0"}]},
+                        {"top": "top1", "do": [{"a": "a1"}]}]
+        # the error goes to the action that had the failing command
+        assert action0.execution_errors() == []
+        assert action1.execution_errors() == []
+        assert action2.execution_errors() == [{"command": {"c": "c0"}, "target": {"top": "top0"},
+                                               "errorCode": "test.error"}]
+
+
+def test_execute_multiple_coalesce_split(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "partial",
+                                                    "completed": 2,
+                                                    "notCompleted": 1,
+                                                    "errors": [{"index": 1, "step": 0,
+                                                                "errorCode": "test.error"}]})
+        conn = Connection(coalesce_actions=True, **mock_connection_params)
+        conn.throttle_commands = 2
+        action0 = Action(top="top0").append(a="a0").append(b="b0")
+        action1 = Action(top="top0").append(c="c0").append(d="d0")
+        assert conn.execute_multiple([action0, action1], immediate=False) == (2, 0, 0)
+        # the merged action is split to the command limit again
+        assert [a.commands for a in conn.action_queue] == [[{"a": "a0"}, {"b": "b0"}], [{"c": "c0"}, {"d": "d0"}]]
+        conn.execute_queued()
+        assert action0.execution_errors() == []
+        assert action1.execution_errors() == [{"command": {"c": "c0"}, "target": {"top": "top0"},
+                                               "errorCode": "test.error"}]
+
+
+def test_execute_multiple_no_coalesce(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(**mock_connection_params)
+        action0 = Action(top="top0").append(a="a0")
+        action1 = Action(top="top0").append(b="b0")
+        assert conn.execute_multiple([action0, action1]) == (0, 2, 2)
+        assert len(json.loads(mock_post.call_args[1]["data"])) == 2
+
+
+def test_execute_multiple_batch_command_limit(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(**mock_connection_params)
+        conn.throttle_batch_commands = 4
+        actions = [Action(top="top{}".format(n)).append(a="a").append(b="b").append(c="c") for n in range(3)]
+        actions.append(Action(top="top3").append(a="a").append(b="b"))
+        # each batch takes as many actions as fit in 4 commands
+        assert conn.execute_multiple(actions, immediate=False) == (1, 3, 3)
+        assert [len(json.loads(c[1]["data"])) for c in mock_post.call_args_list] == [1, 1, 1]
+        assert conn.execute_queued() == (0, 1, 1)
+
+
+def test_execute_multiple_batch_byte_limit(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(**mock_connection_params)
+        actions = [Action(top="top{}".format(n)).append(a="a") for n in range(5)]
+        action_bytes = len(json.dumps(actions[0].wire_dict()))
+        conn.throttle_batch_bytes = 2 + 2 * action_bytes + 2
+        big = Action(top="big").append(a="a" * (3 * action_bytes))
+        assert conn.execute_multiple(actions + [big]) == (0, 6, 6)
+        bodies = [c[1]["data"] for c in mock_post.call_args_list]
+        assert [len(json.loads(body)) for body in bodies] == [2, 2, 1, 1]
+        # an action bigger than the limit goes by itself
+        assert all(len(body) <= conn.throttle_batch_bytes for body in bodies[:3])
+        assert json.loads(bodies[3]) == [big.wire_dict()]
+
+
+def test_linger_flush(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        sent = threading.Event()
+
+        def post(*args, **kwargs):
+            sent.set()
+            return MockResponse(200, {"result": "success"})
+
+        mock_post.side_effect = post
+        with Connection(linger=0.2, **mock_connection_params) as conn:
+            assert conn.execute_single(Action(top="top0").append(a="a0")) == (1, 0, 0)
+            assert conn.execute_single(Action(top="top1").append(a="a1")) == (2, 0, 0)
+            assert not sent.is_set()
+            # the partial batch goes once the first action has lingered long enough
+            assert sent.wait(5)
+            with conn._queue_changed:
+                assert conn.action_queue == []
+            assert mock_post.call_count == 1
+            assert len(json.loads(mock_post.call_args[1]["data"])) == 2
+            assert conn.local_status["actions-completed"] == 2
+
+
+def test_linger_queue_while_sending(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        sending, release = threading.Event(), threading.Event()
+
+        def post(*args, **kwargs):
+            sending.set()
+            assert release.wait(5)
+            return MockResponse(200, {"result": "success"})
+
+        mock_post.side_effect = post
+        with Connection(linger=0.1, **mock_connection_params) as conn:
+            conn.execute_single(Action(top="top0").append(a="a0"))
+            assert sending.wait(5)
+            # the flusher is blocked sending, but producers can still queue
+            start = time.monotonic()
+            assert conn.execute_single(Action(top="top1").append(a="a1")) == (1, 0, 0)
+            assert time.monotonic() - start < 1
+            release.set()
+        assert mock_post.call_count == 2
+        assert conn.local_status["actions-completed"] == 2
+
+
+def test_linger_one_sender_at_a_time(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        sending, release = threading.Event(), threading.Event()
+        in_flight, peak = [], []
+
+        def post(*args, **kwargs):
+            in_flight.append(json.loads(kwargs["data"])[0]["top"])
+            peak.append(len(in_flight))
+            sending.set()
+            assert release.wait(5)
+            in_flight.pop()
+            return MockResponse(200, {"result": "success"})
+
+        mock_post.side_effect = post
+        with Connection(linger=0.1, **mock_connection_params) as conn:
+            conn.throttle_actions = 2
+            conn.execute_single(Action(top="top0").append(a="a0"))
+            assert sending.wait(5)
+            # while the flusher sends the partial batch, a full batch has to wait its turn
+            actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(1, 3)]
+            producer = threading.Thread(target=conn.execute_multiple, args=(actions,))
+            producer.start()
+            time.sleep(0.2)
+            assert mock_post.call_count == 1
+            release.set()
+            producer.join(5)
+        assert peak == [1, 1]
+        assert [json.loads(c[1]["data"])[0]["top"] for c in mock_post.call_args_list] == ["top0", "top1"]
+
+
+def test_exit_keeps_propagating_exception(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(400, text="Bad Request")
+        with pytest.raises(ValueError):
+            with Connection(**mock_connection_params) as conn:
+                conn.execute_single(Action(top="top0").append(a="a0"))
+                raise ValueError("in the with block")
+        # the queued action was still sent on the way out
+        assert mock_post.call_count == 1
+
+
+def test_close_flushes_queue(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(linger=60, **mock_connection_params)
+        conn.execute_single(Action(top="top0").append(a="a0"))
+        assert mock_post.call_count == 0
+        assert conn.close() == (0, 1, 1)
+        assert not conn._flusher.is_alive()
+
+
+def test_close_deadline(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(**mock_connection_params)
+        conn.execute_single(Action(top="top0").append(a="a0"))
+        with pytest.raises(BatchError) as excinfo:
+            conn.close(deadline=time.monotonic() - 1)
+        assert isinstance(excinfo.value.causes[0], UnavailableError)
+        assert mock_post.call_count == 0
+
+
+def test_execute_stream(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = [MockResponse(200, {"result": "success"}),
+                                 MockResponse(200, {"result": "partial",
+                                                    "completed": 9,
+                                                    "notCompleted": 1,
+                                                    "errors": [{"index": 0, "step": 0, "errorCode": "test"}]}),
+                                 MockResponse(500)]
+        conn = Connection(**mock_connection_params)
+        pulled = []
+
+        def actions():
+            for n in range(25):
+                pulled.append(n)
+                yield Action(top="top{}".format(n)).append(a="a{}".format(n))
+
+        results = []
+        for result in conn.execute_stream(actions()):
+            # actions are pulled one batch ahead at most
+            results.append((result, len(pulled)))
+        assert [r for r, _ in results][:2] == [(10, 10, None), (10, 9, None)]
+        assert [n for _, n in results] == [10, 20, 25]
+        sent, completed, error = results[2][0]
+        assert (sent, completed) == (5, 0)
+        assert isinstance(error, ServerError)
+        assert conn.local_status["actions-sent"] == 25
+        assert conn.local_status["actions-completed"] == 19
+
+
+def test_execute_stream_stopped_early(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = [MockResponse(200, {"result": "success"}),
+                                 MockResponse(429, headers={"Retry-After": "30"})]
+        conn = Connection(max_in_flight=2, requeue_throttled=True, **mock_connection_params)
+        conn.throttle_actions = 2
+        conn.execute_single(Action(top="queued").append(a="a"))
+        actions = (Action(top="top{}".format(n)).append(a="a") for n in range(10))
+        stream = conn.execute_stream(actions)
+        assert next(stream) == (2, 2, None)
+        # the queued action went first
+        assert json.loads(mock_post.call_args_list[0][1]["data"])[0]["top"] == "queued"
+        stream.close()
+        # the throttled batch is left on the queue, and nothing more was pulled
+        assert mock_post.call_count == 2
+        assert conn.local_status["actions-sent"] == 2
+        assert [a.frame["top"] for a in conn.action_queue] == ["top1", "top2"]
+        assert conn.local_status["actions-queued"] == 2
+        assert next(actions).frame["top"] == "top3"
+
+
+def test_execute_stream_throttled_past_deadline(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post, \
+            mock.patch("umapi_client.connection.sleep") as mock_sleep:
+        mock_post.return_value = MockResponse(429, headers={"Retry-After": "3600"})
+        conn = Connection(requeue_throttled=True, **mock_connection_params)
+        conn.throttle_actions = 2
+        actions = [Action(top="top{}".format(n)).append(a="a") for n in range(4)]
+        results = list(conn.execute_stream(actions, deadline=time.monotonic() + 5))
+        # the server's advised wait would go past the deadline, so the batches fail rather than wait
+        assert mock_sleep.call_count == 0
+        assert mock_post.call_count == 1
+        assert [(sent, completed) for sent, completed, _ in results] == [(2, 0), (2, 0)]
+        assert all(isinstance(error, UnavailableError) for _, _, error in results)
+
+
+def test_execute_multiple_request_ids(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(request_ids=True, **mock_connection_params)
+        conn.throttle_commands = 2
+        action0 = Action(top="top0").append(a="a0")
+        action1 = Action(top="top1", requestID="mine").append(a="a1")
+        action2 = Action(top="top2").append(a="a").append(b="b").append(c="c")
+        assert conn.execute_multiple([action0, action1, action2]) == (0, 4, 4)
+        ids = [a["requestID"] for a in json.loads(mock_post.call_args[1]["data"])]
+        request_id = action0.frame["requestID"]
+        assert ids == [request_id, "mine", action2.frame["requestID"] + ".0", action2.frame["requestID"] + ".1"]
+        assert request_id.startswith(conn.uuid)
+        assert len(set(ids)) == 4
+        pytest.raises(ArgumentError, Connection, request_ids=True, coalesce_actions=True, **mock_connection_params)
+
+
+def test_execute_multiple_skip_acknowledged(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = [MockResponse(200, {"result": "success"}), MockResponse(400),
+                                 MockResponse(200, {"result": "success"})]
+        conn = Connection(request_ids=True, **mock_connection_params)
+        conn.throttle_actions = 2
+        actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(4)]
+        pytest.raises(BatchError, conn.execute_multiple, actions)
+        # running the same actions again only sends the ones the server didn't acknowledge
+        assert conn.execute_multiple(actions) == (0, 2, 2)
+        assert [a["top"] for a in json.loads(mock_post.call_args[1]["data"])] == ["top2", "top3"]
+
+
+def test_acknowledged_bounded(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(request_ids=True, max_acknowledged=3, **mock_connection_params)
+        actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(5)]
+        conn.execute_multiple(actions)
+        assert list(conn._acknowledged) == [a.frame["requestID"] for a in actions[2:]]
+        # the forgotten ones are sent again
+        assert conn.execute_multiple(actions) == (0, 2, 2)
+
+
+def test_execute_multiple_retry_command_error(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = [MockResponse(200, {"result": "partial",
+                                                    "completed": 1,
+                                                    "notCompleted": 1,
+                                                    "errors": [{"index": 1, "step": 0,
+                                                                "errorCode": "group.not_found"}]}),
+                                 MockResponse(200, {"result": "success"})]
+        conn = Connection(request_ids=True, **mock_connection_params)
+        actions = [Action(top="top0").append(a="a0"), Action(top="top1").append(a="a1")]
+        assert conn.execute_multiple(actions) == (0, 2, 1)
+        # the action that failed is sent again, the one that worked isn't
+        assert conn.execute_multiple(actions) == (0, 1, 1)
+        assert [a["top"] for a in json.loads(mock_post.call_args[1]["data"])] == ["top1"]
+
+
+def test_execute_multiple_caller_request_ids(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(request_ids=True, **mock_connection_params)
+        # the caller uses one request ID for all the actions of a run
+        assert conn.execute_single(Action(top="top0", requestID="run1").append(a="a0"), immediate=True) == (0, 1, 1)
+        assert conn.execute_single(Action(top="top1", requestID="run1").append(a="a1"), immediate=True) == (0, 1, 1)
+        assert mock_post.call_count == 2
+        assert json.loads(mock_post.call_args[1]["data"])[0]["top"] == "top1"
@@ -0,0 +1,247 @@
+# Copyright (c) 2016-2021 Adobe Inc.  All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime as dt
+import os
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+import mock
+import pytest
+import requests
+
+from conftest import MockResponse
+
+from umapi_client import OAuthS2S, TokenCache, AuthRegistry, Connection, RequestError
+
+
+def test_refresh_token():
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, body={"access_token": "token1", "expires_in": 86400})
+        auth = OAuthS2S("client_id", "client_secret")
+        req = auth(requests.Request('GET', "http://test.com/").prepare())
+        assert req.headers["Authorization"] == "Bearer token1"
+        assert req.headers["x-api-key"] == "client_id"
+        assert mock_post.call_args[0][0] == "https://ims-na1.adobelogin.com/ims/token/v2/"
+        # the token is reused while it is valid
+        auth(requests.Request('GET', "http://test.com/").prepare())
+        assert mock_post.call_count == 1
+
+
+def test_refresh_token_failure():
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(400, text="bad client")
+        auth = OAuthS2S("client_id", "client_secret")
+        pytest.raises(RuntimeError, auth.refresh_token)
+
+
+def test_refresh_single_flight():
+    def post(*args, **kwargs):
+        time.sleep(0.1)
+        return MockResponse(200, body={"access_token": "token1", "expires_in": 86400})
+
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.side_effect = post
+        auth = OAuthS2S("client_id", "client_secret")
+        requests_seen = []
+        threads = [threading.Thread(target=lambda: requests_seen.append(
+            auth(requests.Request('GET', "http://test.com/").prepare()))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert mock_post.call_count == 1
+        assert [r.headers["Authorization"] for r in requests_seen] == ["Bearer token1"] * 8
+
+
+def test_refresh_in_background():
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, body={"access_token": "token1", "expires_in": 100})
+        auth = OAuthS2S("client_id", "client_secret")
+        auth.refresh_token()
+        assert auth.refresh_at - time.monotonic() <= 80
+        # once the refresh time has passed, the still-valid token is used while a new one is fetched
+        auth.refresh_at = time.monotonic() - 1
+        release = threading.Event()
+
+        def post(*args, **kwargs):
+            release.wait(5)
+            return MockResponse(200, body={"access_token": "token2", "expires_in": 100})
+
+        mock_post.side_effect = post
+        req = auth(requests.Request('GET', "http://test.com/").prepare())
+        assert req.headers["Authorization"] == "Bearer token1"
+        req = auth(requests.Request('GET', "http://test.com/").prepare())
+        assert req.headers["Authorization"] == "Bearer token1"
+        release.set()
+        for _ in range(50):
+            if auth.token == "token2":
+                break
+            time.sleep(0.1)
+        req = auth(requests.Request('GET', "http://test.com/").prepare())
+        assert req.headers["Authorization"] == "Bearer token2"
+        assert mock_post.call_count == 2
+
+
+def test_refresh_in_background_failure():
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, body={"access_token": "token1", "expires_in": 100})
+        auth = OAuthS2S("client_id", "client_secret")
+        auth.refresh_token()
+        auth.refresh_at = time.monotonic() - 1
+        mock_post.return_value = MockResponse(500, text="down")
+        req = auth(requests.Request('GET', "http://test.com/").prepare())
+        assert req.headers["Authorization"] == "Bearer token1"
+        with auth._refresh_lock:
+            # the failed refresh is retried later, not on every request
+            assert auth.refresh_at > time.monotonic()
+        assert auth.token == "token1"
+
+
+def test_token_cache_shared(tmp_path):
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, body={"access_token": "token1", "expires_in": 86400})
+        auth1 = OAuthS2S("client_id", "client_secret", token_cache=TokenCache(str(tmp_path)))
+        auth1.refresh_token()
+        # a second process using the same integration finds the token in the cache
+        auth2 = OAuthS2S("client_id", "client_secret", token_cache=TokenCache(str(tmp_path)))
+        req = auth2(requests.Request('GET', "http://test.com/").prepare())
+        assert req.headers["Authorization"] == "Bearer token1"
+        assert abs(auth2.expiry - auth1.expiry) < dt.timedelta(seconds=1)
+        assert mock_post.call_count == 1
+        # but a different integration doesn't
+        auth3 = OAuthS2S("client_id2", "client_secret", token_cache=TokenCache(str(tmp_path)))
+        auth3.refresh_token()
+        assert mock_post.call_count == 2
+
+
+def test_token_cache_expired(tmp_path):
+    cache = TokenCache(str(tmp_path))
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, body={"access_token": "token2", "expires_in": 86400})
+        auth = OAuthS2S("client_id", "client_secret", token_cache=cache)
+        now = time.time()
+        cache.store(auth.cache_key(), "expired", now - 100, now - 1)
+        assert cache.load(auth.cache_key()) is None
+        # a token that is due for refresh isn't used either
+        cache.store(auth.cache_key(), "stale", now - 90, now + 10)
+        auth.refresh_token()
+        assert auth.token == "token2"
+        assert mock_post.call_count == 1
+        assert cache.load(auth.cache_key())[0] == "token2"
+
+
+def test_token_cache_file_mode(tmp_path):
+    cache = TokenCache(str(tmp_path))
+    cache.store("key", "token", time.time(), time.time() + 100)
+    path = cache._path("key")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
+
+
+def test_shared_auth():
+    registry = AuthRegistry()
+    auth = registry.get(OAuthS2S, "client_id", "client_secret")
+    assert registry.get(OAuthS2S, client_id="client_id", client_secret="client_secret", ssl_verify=True) is auth
+    assert registry.get(OAuthS2S, "client_id2", "client_secret") is not auth
+    registry.clear()
+    assert registry.get(OAuthS2S, "client_id", "client_secret") is not auth
+
+
+def test_shared_auth_one_fetch():
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, body={"access_token": "token1", "expires_in": 86400})
+        conns = [Connection(org_id="N/A", auth=OAuthS2S.shared("shared_id", "client_secret"))
+                 for _ in range(3)]
+        assert conns[0].auth is conns[2].auth
+        for conn in conns:
+            conn.auth(requests.Request('GET', "http://test.com/").prepare())
+        assert mock_post.call_count == 1
+
+
+def test_expiry_margin():
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, body={"access_token": "token1", "expires_in": 3600})
+        auth = OAuthS2S("client_id", "client_secret", refresh_ratio=None, expiry_margin=120)
+        auth.refresh_token()
+        assert 3470 < auth.valid_until - time.monotonic() <= 3480
+        # a wall-clock jump doesn't affect when the token expires
+        with mock.patch("umapi_client.auth.dt.datetime") as mock_datetime:
+            mock_datetime.now.return_value = dt.datetime.now() + dt.timedelta(days=1)
+            assert auth._token_valid()
+        # the margin is never more than half the token's lifetime
+        mock_post.return_value = MockResponse(200, body={"access_token": "token2", "expires_in": 100})
+        auth.refresh_token()
+        assert 40 < auth.valid_until - time.monotonic() <= 50
+
+
+def test_invalidate_token(tmp_path):
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, body={"access_token": "token1", "expires_in": 86400})
+        auth = OAuthS2S("client_id", "client_secret", token_cache=TokenCache(str(tmp_path)))
+        auth(requests.Request('GET', "http://test.com/").prepare())
+        # a token that has already been replaced is left alone
+        auth.invalidate_token("token0")
+        assert auth._token_valid()
+        auth.invalidate_token("token1")
+        assert not auth._token_valid()
+        # the rejected token is not picked up from the cache
+        assert auth.token_cache.load(auth.cache_key()) is None
+        mock_post.return_value = MockResponse(200, body={"access_token": "token2", "expires_in": 86400})
+        req = auth(requests.Request('GET', "http://test.com/").prepare())
+        assert req.headers["Authorization"] == "Bearer token2"
+        assert mock_post.call_count == 2
+
+
+def test_retry_on_401():
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post, \
+            mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_post.side_effect = [MockResponse(200, body={"access_token": "token1", "expires_in": 86400}),
+                                 MockResponse(200, body={"access_token": "token2", "expires_in": 86400})]
+        auth = OAuthS2S("client_id", "client_secret")
+        auth.refresh_token()
+        rejected = MockResponse(401, text="expired token")
+        rejected.request = auth(requests.Request('GET', "http://test.com/").prepare())
+        mock_get.side_effect = [rejected, MockResponse(200, body={"result": "success"})]
+        conn = Connection(org_id="N/A", auth=auth)
+        assert conn.make_call("/test").json() == {"result": "success"}
+        assert mock_get.call_count == 2
+        assert auth(requests.Request('GET', "http://test.com/").prepare()).headers["Authorization"] == "Bearer token2"
+
+
+def test_401_retried_once():
+    with mock.patch("umapi_client.auth.requests.Session.post") as mock_post, \
+            mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_post.return_value = MockResponse(200, body={"access_token": "token1", "expires_in": 86400})
+        mock_get.return_value = MockResponse(401, text="bad client")
+        conn = Connection(org_id="N/A", auth=OAuthS2S("client_id", "client_secret"))
+        pytest.raises(RequestError, conn.make_call, "/test")
+        assert mock_get.call_count == 2
+
+
+def test_import_skips_jwt():
+    # OAuthS2S users shouldn't pay for importing the JWT libraries
+    code = "import sys, umapi_client; print(sorted(m for m in ('jwt', 'cryptography') if m in sys.modules))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", code], cwd=root, check=True, capture_output=True, text=True)
+    assert out.stdout.strip() == "[]"
@@ -18,18 +18,21 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import asyncio
 import time
 from email.utils import formatdate
 
+import jwt
 import mock
 import pytest
 import requests
+from cryptography.hazmat.primitives import serialization
 from pathlib import Path
 
 from conftest import MockResponse
 
-from umapi_client import Connection
-from umapi_client import ArgumentError, UnavailableError, ServerError, RequestError
+from umapi_client import Connection, AsyncConnection
+from umapi_client import ArgumentError, UnavailableError, ServerError, RequestError, BatchError
 from umapi_client import UserAction, IdentityType, GroupAction
 from umapi_client import __version__ as umapi_version
 from umapi_client.auth import JWTAuth
@@ -511,3 +514,184 @@ def test_jwt(fixture_dir):
     with open(Path(fixture_dir) / 'private.key') as keyfile:
         auth = JWTAuth('xxxxxx', 'xxxxx', 'example.com', 'xxxxx', keyfile.read())
         auth.jwt_token()
+
+
+def test_jwt_key_parsed_once(fixture_dir):
+    with open(Path(fixture_dir) / 'private.key') as keyfile:
+        auth = JWTAuth('xxxxxx', 'xxxxx', 'example.com', 'xxxxx', keyfile.read())
+    with mock.patch("cryptography.hazmat.primitives.serialization.load_pem_private_key",
+                    wraps=serialization.load_pem_private_key) as mock_load:
+        auth.jwt_token()
+        token2 = auth.jwt_token()
+        assert mock_load.call_count == 1
+    claims = jwt.decode(token2, auth.private_key().public_key(), algorithms=['RS256'],
+                        audience="https://ims-na1.adobelogin.com/c/xxxxx")
+    assert claims["iss"] == "xxxxxx"
+
+
+def test_async_get_success(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.return_value = MockResponse(200, body=["test", "body"])
+        conn = AsyncConnection(**mock_connection_params)
+        result = asyncio.run(conn.make_call(""))
+        assert result.json() == ["test", "body"]
+
+
+def test_async_retry_does_not_block(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get, \
+            mock.patch("umapi_client.connection.asyncio.sleep") as mock_async_sleep, \
+            mock.patch("umapi_client.connection.sleep") as mock_sleep:
+        mock_get.side_effect = [MockResponse(429, headers={"Retry-After": "3"}),
+                                MockResponse(200, body=["test", "body"])]
+        conn = AsyncConnection(**mock_connection_params)
+        result = asyncio.run(conn.make_call(""))
+        assert result.json() == ["test", "body"]
+        assert mock.call(3) in mock_async_sleep.call_args_list
+        mock_sleep.assert_not_called()
+
+
+def test_async_get_timeout(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = requests.Timeout
+        conn = AsyncConnection(**mock_connection_params)
+        conn.retry_max_attempts = 2
+        conn.retry_first_delay = 0
+        conn.retry_random_delay = 0
+        pytest.raises(UnavailableError, asyncio.run, conn.make_call(""))
+        assert mock_get.call_count == 2
+
+
+def test_async_query_single(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = [MockResponse(200, {"result": "success", "user": {"name": "n1", "type": "user"}}),
+                                MockResponse(404, text="404 Object not found")]
+        conn = AsyncConnection(**mock_connection_params)
+        assert asyncio.run(conn.query_single("user", ["n1"])) == {"name": "n1", "type": "user"}
+        assert asyncio.run(conn.query_single("user", ["n2"])) == {}
+        assert conn.status()[0]["single-query-count"] == 2
+
+
+def test_async_query_multiple(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.return_value = MockResponse(200, {"result": "success",
+                                                   "lastPage": True,
+                                                   "users": [{"name": "n1", "type": "user"}]})
+        conn = AsyncConnection(**mock_connection_params)
+        assert asyncio.run(conn.query_multiple("user")) == ([{"name": "n1", "type": "user"}], True, 0, 0, 1, 0)
+
+
+def test_async_execute_multiple(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = [MockResponse(200, {"result": "success"}),
+                                 MockResponse(500, text="500 test server failure")]
+        conn = AsyncConnection(**mock_connection_params)
+        conn.throttle_actions = 2
+        actions = [UserAction(user="user{}@example.com".format(n)).add_to_groups(["G1"]) for n in range(3)]
+        assert asyncio.run(conn.execute_multiple(actions, immediate=False)) == (1, 2, 2)
+        with pytest.raises(BatchError):
+            asyncio.run(conn.execute_queued())
+        assert conn.status()[0]["actions-sent"] == 3
+
+
+def test_connection_pool(mock_connection_params):
+    conn = Connection(**mock_connection_params)
+    adapter = conn.session.get_adapter("https://test/")
+    assert adapter._pool_maxsize == 10
+    assert conn.session.get_adapter("http://test/") is adapter
+    conn = Connection(max_in_flight=16, pool_connections=2, pool_block=True, **mock_connection_params)
+    adapter = conn.session.get_adapter("https://test/")
+    assert (adapter._pool_connections, adapter._pool_maxsize, adapter._pool_block) == (2, 16, True)
+    conn = Connection(pool_maxsize=4, **mock_connection_params)
+    assert conn.session.get_adapter("https://test/")._pool_maxsize == 4
+
+
+def test_connection_keep_alive(mock_connection_params):
+    conn = Connection(**mock_connection_params)
+    req = conn.session.prepare_request(requests.Request('GET', "http://test.com/"))
+    assert req.headers.get("Connection") != "close"
+    conn = Connection(keep_alive=False, **mock_connection_params)
+    req = conn.session.prepare_request(requests.Request('GET', "http://test.com/"))
+    assert req.headers.get("Connection") == "close"
+
+
+def test_warm_up(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.return_value = MockResponse(200, body={"state": "LIVE"})
+        auth = mock.MagicMock()
+        mock_connection_params["auth"] = auth
+        conn = Connection(max_in_flight=3, **mock_connection_params)
+        assert conn.warm_up() is None
+        assert auth.call_count == 1
+        # one status call for each connection a batch may need
+        assert mock_get.call_count == 3
+        assert mock_get.call_args[0][0] == "https://test/status"
+        assert conn.server_status["state"] == "LIVE"
+
+
+def test_warm_up_best_effort(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = requests.ConnectionError
+        auth = mock.MagicMock(side_effect=RuntimeError("Unable to authorize"))
+        mock_connection_params["auth"] = auth
+        conn = Connection(**mock_connection_params)
+        conn.warm_up()
+        assert auth.call_count == 1
+        assert conn.server_status["status"].startswith("Unreachable")
+
+
+def test_eager_warm_up(mock_connection_params):
+    with mock.patch("umapi_client.connection.Connection.warm_up") as mock_warm_up:
+        Connection(**mock_connection_params)
+        assert mock_warm_up.call_count == 0
+        Connection(eager=True, **mock_connection_params)
+        mock_warm_up.assert_called_once_with(background=True)
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.return_value = MockResponse(200, body={"state": "LIVE"})
+        conn = Connection(**mock_connection_params)
+        conn.warm_up(background=True).join(5)
+        assert mock_get.call_count == 1
+
+
+def test_async_close(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+
+        async def run():
+            async with AsyncConnection(**mock_connection_params) as conn:
+                await conn.execute_single(UserAction("user@example.com").add_to_groups(["group1"]))
+                assert mock_post.call_count == 0
+            return conn
+
+        conn = asyncio.run(run())
+        assert mock_post.call_count == 1
+        assert conn.local_status["actions-completed"] == 1
+        pytest.raises(ArgumentError, AsyncConnection, linger=1, **mock_connection_params)
+
+
+def test_async_execute_stream(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = AsyncConnection(**mock_connection_params)
+        actions = (UserAction("user{}@example.com".format(n)).add_to_groups(["group1"]) for n in range(15))
+
+        async def run():
+            return [result async for result in conn.execute_stream(actions)]
+
+        assert asyncio.run(run()) == [(10, 10, None), (5, 5, None)]
+        assert conn.local_status["actions-completed"] == 15
+
+
+def test_async_execute_stream_throttled_past_deadline(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post, \
+            mock.patch("umapi_client.connection.asyncio.sleep") as mock_sleep:
+        mock_post.return_value = MockResponse(429, headers={"Retry-After": "3600"})
+        conn = AsyncConnection(requeue_throttled=True, **mock_connection_params)
+        actions = (UserAction("user{}@example.com".format(n)).add_to_groups(["group1"]) for n in range(5))
+
+        async def run():
+            return [result async for result in conn.execute_stream(actions, deadline=time.monotonic() + 5)]
+
+        (result,) = asyncio.run(run())
+        assert result[:2] == (5, 0)
+        assert isinstance(result[2], UnavailableError)
+        assert mock_sleep.call_count == 0
@@ -20,6 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import mock
 import pytest
 
 from conftest import MockResponse
@@ -28,6 +29,7 @@ from umapi_client import Connection
 from umapi_client import IdentityType
 from umapi_client import UserAction, GroupAction
 from umapi_client import UsersQuery
+from umapi_client import MembershipPlanner
 
 
 def test_user_emptyid():
@@ -314,3 +316,63 @@ def test_query_users(mock_connection_params):
     assert query.url_params == ["test"]
     assert query.query_params == {"directOnly": False, "domain": "test.com"}
 
+
+def test_plan_group_centric(mock_connection_params):
+    conn = Connection(**mock_connection_params)
+    planner = MembershipPlanner(conn)
+    changes = [planner.add_to_groups("user{}@example.com".format(n), ["X"]) for n in range(25)]
+    actions = planner.plan()
+    # 25 users to one group fit on one group action, in lists of 10
+    assert [a.wire_dict() for a in actions] == [
+        {"usergroup": "X", "do": [{"add": {"user": ["user{}@example.com".format(n) for n in range(0, 10)]}},
+                                  {"add": {"user": ["user{}@example.com".format(n) for n in range(10, 20)]}},
+                                  {"add": {"user": ["user{}@example.com".format(n) for n in range(20, 25)]}}]}]
+    assert all(c.execution_errors() == [] for c in changes)
+
+
+def test_plan_user_centric(mock_connection_params):
+    conn = Connection(**mock_connection_params)
+    planner = MembershipPlanner(conn)
+    planner.add_to_groups("user1@example.com", ["A", "B", "C"])
+    planner.remove_from_groups("user1@example.com", ["D"])
+    planner.add_to_groups("user2@example.com", ["A"])
+    planner.add_to_groups("user3", ["A"], domain="example.com")
+    actions = planner.plan()
+    # no group is big enough to be worth its own action
+    assert [a.wire_dict() for a in actions] == [
+        {"user": "user1@example.com", "do": [{"add": {"group": ["A", "B", "C"]}}, {"remove": {"group": ["D"]}}]},
+        {"user": "user2@example.com", "do": [{"add": {"group": ["A"]}}]},
+        {"user": "user3", "domain": "example.com", "do": [{"add": {"group": ["A"]}}]}]
+
+
+def test_plan_mixed(mock_connection_params):
+    conn = Connection(**mock_connection_params)
+    planner = MembershipPlanner(conn)
+    for n in range(20):
+        planner.add_to_groups("user{}@example.com".format(n), ["Big"])
+    planner.add_to_groups("user0@example.com", ["Small"])
+    # a later change to the same membership replaces the earlier one
+    planner.remove_from_groups("user1@example.com", ["Big"])
+    actions = planner.plan()
+    assert len(actions) == 2
+    assert actions[0].wire_dict() == {"user": "user0@example.com", "do": [{"add": {"group": ["Small"]}}]}
+    assert actions[1].frame == {"usergroup": "Big"}
+    assert actions[1].commands[-1] == {"remove": {"user": ["user1@example.com"]}}
+
+
+def test_plan_errors(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "partial",
+                                                    "completed": 0,
+                                                    "notCompleted": 1,
+                                                    "errors": [{"index": 0, "step": 0,
+                                                                "user": "user3@example.com",
+                                                                "errorCode": "error.user.nonexistent"}]})
+        conn = Connection(**mock_connection_params)
+        planner = MembershipPlanner(conn)
+        changes = [planner.add_to_groups("user{}@example.com".format(n), ["X"]) for n in range(5)]
+        conn.execute_multiple(planner.plan())
+        # the error names a user, so only that user's change gets it
+        assert [len(c.execution_errors()) for c in changes] == [0, 0, 0, 1, 0]
+        assert changes[3].execution_errors()[0]["errorCode"] == "error.user.nonexistent"
+        assert changes[3].execution_errors()[0]["target"] == {"usergroup": "X"}
@@ -0,0 +1,174 @@
+# Copyright (c) 2016-2021 Adobe Inc.  All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+
+import mock
+import pytest
+
+from conftest import MockResponse
+
+from umapi_client import Connection, Action, ActionJournal, BatchError, ArgumentError
+
+
+def _journal_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_journal_records_queue_and_done(mock_connection_params, tmp_path):
+    path = str(tmp_path / "journal")
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(journal=ActionJournal(path), **mock_connection_params)
+        conn.throttle_actions = 2
+        actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(3)]
+        assert conn.execute_multiple(actions, immediate=False) == (1, 2, 2)
+        assert _journal_lines(path) == [{"queued": 0, "action": {"top": "top0", "do": [{"a": "a0"}]}},
+                                        {"queued": 1, "action": {"top": "top1", "do": [{"a": "a1"}]}},
+                                        {"queued": 2, "action": {"top": "top2", "do": [{"a": "a2"}]}},
+                                        {"done": [0, 1]}]
+        # once everything is done, the journal starts over
+        conn.execute_queued()
+        assert _journal_lines(path) == []
+
+
+def test_journal_resume(mock_connection_params, tmp_path):
+    path = str(tmp_path / "journal")
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = [MockResponse(200, {"result": "success"}), MockResponse(503), MockResponse(503)]
+        conn = Connection(journal=ActionJournal(path), max_retries=2, **mock_connection_params)
+        conn.retry_first_delay = conn.retry_random_delay = 0
+        conn.throttle_actions = 2
+        actions = [Action(top="top{}".format(n)).append(a="a{}".format(n)) for n in range(5)]
+        # the second batch never gets through, and the last action is still queued when we "die"
+        pytest.raises(BatchError, conn.execute_multiple, actions, immediate=False)
+        conn.journal.close()
+        # a torn write at the end of the file is ignored
+        with open(path, "a") as f:
+            f.write('{"queued": 9, "act')
+
+        mock_post.side_effect = None
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(journal=ActionJournal(path), **mock_connection_params)
+        assert conn.resume() == 3
+        assert [a.wire_dict() for a in conn.action_queue] == [{"top": "top2", "do": [{"a": "a2"}]},
+                                                               {"top": "top3", "do": [{"a": "a3"}]},
+                                                               {"top": "top4", "do": [{"a": "a4"}]}]
+        assert conn.execute_queued() == (0, 3, 3)
+        assert json.loads(mock_post.call_args[1]["data"])[0]["top"] == "top2"
+        assert _journal_lines(path) == []
+        pytest.raises(ArgumentError, Connection(**mock_connection_params).resume)
+
+
+def test_journal_request_error_is_done(mock_connection_params, tmp_path):
+    path = str(tmp_path / "journal")
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(400, text="bad request")
+        conn = Connection(journal=ActionJournal(path), **mock_connection_params)
+        pytest.raises(BatchError, conn.execute_single, Action(top="top0").append(a="a0"), immediate=True)
+        # the server rejected it, so sending it again on resume would be pointless
+        assert ActionJournal(path).pending_actions() == []
+
+
+def test_journal_coalesced(mock_connection_params, tmp_path):
+    path = str(tmp_path / "journal")
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(journal=ActionJournal(path), coalesce_actions=True, **mock_connection_params)
+        conn.execute_multiple([Action(top="top0").append(a="a0"), Action(top="top1").append(a="a1")],
+                              immediate=False)
+        conn.execute_multiple([Action(top="top0").append(b="b0")], immediate=False)
+        assert [e["queued"] for e in _journal_lines(path)] == [0, 1, 2]
+        assert conn.execute_queued() == (0, 2, 2)
+        assert _journal_lines(path) == []
+
+
+def test_journal_coalesced_split_source(mock_connection_params, tmp_path):
+    path = str(tmp_path / "journal")
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.side_effect = [MockResponse(200, {"result": "success"}), MockResponse(503), MockResponse(503)]
+        conn = Connection(journal=ActionJournal(path), coalesce_actions=True, max_retries=2,
+                          **mock_connection_params)
+        conn.retry_first_delay = conn.retry_random_delay = 0
+        conn.throttle_actions, conn.throttle_commands = 1, 2
+        actions = [Action(top="x").append(b="b0"), Action(top="x").append(c="c0").append(c="c1")]
+        # coalesced as [b0, c0] and [c1], and only the first of those gets through
+        pytest.raises(BatchError, conn.execute_multiple, actions)
+        assert [json.loads(c[1]["data"])[0]["do"] for c in mock_post.call_args_list] == \
+            [[{"b": "b0"}, {"c": "c0"}], [{"c": "c1"}], [{"c": "c1"}]]
+        assert [a.wire_dict() for a in ActionJournal(path).pending_actions()] == \
+            [{"top": "x", "do": [{"c": "c0"}, {"c": "c1"}]}]
+        conn.journal.close()
+        # so the second action is sent again on resume
+        mock_post.side_effect = None
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        conn = Connection(journal=ActionJournal(path), **mock_connection_params)
+        assert conn.resume() == 1
+        assert conn.execute_queued() == (0, 1, 1)
+        assert _journal_lines(path) == []
+
+
+def test_journal_keeps_request_ids(mock_connection_params, tmp_path):
+    path = str(tmp_path / "journal")
+    conn = Connection(journal=ActionJournal(path), request_ids=True, **mock_connection_params)
+    action = Action(top="top0").append(a="a0")
+    conn.execute_single(action)
+    conn.journal.close()
+    conn = Connection(journal=ActionJournal(path), request_ids=True, **mock_connection_params)
+    conn.resume()
+    assert conn.action_queue[0].frame["requestID"] == action.frame["requestID"]
+
+
+def test_journal_unsent_batch_stays_pending(mock_connection_params, tmp_path):
+    path = str(tmp_path / "journal")
+    # the auth object fails (as when the auth server is down), so the request is never sent
+    mock_connection_params["auth"] = mock.MagicMock(side_effect=RuntimeError("Unable to authorize"))
+    conn = Connection(journal=ActionJournal(path), **mock_connection_params)
+    with pytest.raises(BatchError) as excinfo:
+        conn.execute_single(Action(top="top0").append(a="a0"), immediate=True)
+    assert isinstance(excinfo.value.causes[0], RuntimeError)
+    assert mock_connection_params["auth"].call_count == 1
+    # so the batch stays pending for the next run
+    assert [a.frame for a in ActionJournal(path).pending_actions()] == [{"top": "top0"}]
+
+
+def test_journal_resume_only_once(mock_connection_params, tmp_path):
+    path = str(tmp_path / "journal")
+    conn = Connection(journal=ActionJournal(path), **mock_connection_params)
+    conn.execute_multiple([Action(top="top{}".format(n)).append(a="a") for n in range(3)], immediate=False)
+    # the actions this process queued are already on its queue
+    assert conn.resume() == 0
+    assert len(conn.action_queue) == 3
+    conn.journal.close()
+    conn = Connection(journal=ActionJournal(path), **mock_connection_params)
+    assert conn.resume() == 3
+    assert conn.resume() == 0
+    assert len(conn.action_queue) == 3
+
+
+def test_close_closes_journal(mock_connection_params, tmp_path):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post:
+        mock_post.return_value = MockResponse(200, {"result": "success"})
+        journal = ActionJournal(str(tmp_path / "journal"))
+        with Connection(journal=journal, **mock_connection_params) as conn:
+            conn.execute_single(Action(top="top0").append(a="a0"))
+        assert journal._file.closed
+        assert mock_post.call_count == 1
@@ -18,12 +18,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import threading
+
 import pytest
 
 import mock
 
 from conftest import MockResponse
-from umapi_client import Connection, QueryMultiple, QuerySingle, ClientError, RequestError
+from umapi_client import Connection, QueryMultiple, QuerySingle, UsersQuery, ClientError, RequestError
 
 
 def test_query_single_success(mock_connection_params):
@@ -354,3 +356,125 @@ def test_qm_usergroup_reload(mock_connection_params):
                                     {"name": "n6", "type": "user-group"},
                                     {"name": "n7", "type": "user-group"},
                                     {"name": "n8", "type": "user-group"}]
+
+
+def _usergroup_page(url, page_count=4, page_size=2):
+    """Serve a page of a user-group query, based on the page number in the URL"""
+    page = int(url.split("page=")[1].split("&")[0])
+    return MockResponse(200,
+                        [{"name": "n{}".format((page - 1) * page_size + n + 1), "type": "user-group"}
+                         for n in range(page_size)],
+                        {"X-Total-Count": str(page_count * page_size),
+                         "X-Page-Count": str(page_count),
+                         "X-Current-Page": str(page),
+                         "X-Page-Size": str(page_size)})
+
+
+def test_qm_usergroup_parallel_pages(mock_connection_params):
+    # after the first page, the remaining three are only served once all of them have been requested
+    barrier = threading.Barrier(3, timeout=5)
+
+    def get(url, **kwargs):
+        if "page=1" not in url:
+            barrier.wait()
+        return _usergroup_page(url)
+
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = get
+        conn = Connection(**mock_connection_params)
+        qm = QueryMultiple(conn, "user-group", page_concurrency=3)
+        assert [obj["name"] for obj in qm] == ["n{}".format(n + 1) for n in range(8)]
+        assert mock_get.call_count == 4
+        assert qm.stats() == (8, 4, 2, 4)
+
+
+def test_qm_usergroup_parallel_all_results(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = lambda url, **kwargs: _usergroup_page(url, page_count=10)
+        conn = Connection(**mock_connection_params)
+        qm = QueryMultiple(conn, "user-group", page_concurrency=4)
+        assert [obj["name"] for obj in qm.all_results()] == ["n{}".format(n + 1) for n in range(20)]
+        assert mock_get.call_count == 10
+        assert conn.status()[0]["multiple-query-count"] == 10
+
+
+def test_qm_usergroup_parallel_error(mock_connection_params):
+    def get(url, **kwargs):
+        if "page=3" in url:
+            return MockResponse(400, text="400 bad request")
+        return _usergroup_page(url)
+
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = get
+        conn = Connection(**mock_connection_params)
+        qm = QueryMultiple(conn, "user-group", page_concurrency=3)
+        names = []
+        with pytest.raises(RequestError):
+            for obj in qm:
+                names.append(obj["name"])
+        assert names == ["n1", "n2", "n3", "n4"]
+
+
+def _user_page(url, page_count=3, page_size=2):
+    """Serve a page of a user query, based on the page number in the URL"""
+    page = int(url.split("/users/N/A/")[1].split("?")[0].split("/")[0])
+    if page >= page_count:
+        return MockResponse(200, {"result": "success", "lastPage": True, "users": []})
+    return MockResponse(200, {"result": "success",
+                              "lastPage": page == page_count - 1,
+                              "users": [{"name": "n{}".format(page * page_size + n + 1), "type": "user"}
+                                        for n in range(page_size)]})
+
+
+def test_qm_user_read_ahead(mock_connection_params):
+    requested = {n: threading.Event() for n in range(5)}
+
+    def get(url, **kwargs):
+        response = _user_page(url)
+        requested[int(url.split("/users/N/A/")[1].split("?")[0])].set()
+        return response
+
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = get
+        conn = Connection(**mock_connection_params)
+        qm = UsersQuery(conn, read_ahead=1)
+        names = []
+        for obj in qm:
+            if obj["name"] == "n1":
+                # the next page is fetched in the background while we work on this one
+                assert requested[1].wait(5)
+            names.append(obj["name"])
+        assert names == ["n1", "n2", "n3", "n4", "n5", "n6"]
+        assert qm.all_results() == [{"name": name, "type": "user"} for name in names]
+
+
+def test_qm_user_read_ahead_past_end(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = lambda url, **kwargs: _user_page(url, page_count=1)
+        conn = Connection(**mock_connection_params)
+        qm = UsersQuery(conn, read_ahead=3)
+        assert [obj["name"] for obj in qm] == ["n1", "n2"]
+
+
+def test_qm_usergroup_iter_pages(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = lambda url, **kwargs: _usergroup_page(url, page_count=3)
+        conn = Connection(**mock_connection_params)
+        qm = QueryMultiple(conn, "user-group")
+        pages = []
+        for page in qm.iter_pages():
+            pages.append([obj["name"] for obj in page])
+            assert qm._results == []
+        assert pages == [["n1", "n2"], ["n3", "n4"], ["n5", "n6"]]
+        assert qm.stats() == (6, 3, 2, 3)
+
+
+def test_qm_user_stream(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        mock_get.side_effect = lambda url, **kwargs: _user_page(url)
+        conn = Connection(**mock_connection_params)
+        qm = UsersQuery(conn, read_ahead=1)
+        assert [obj["name"] for obj in qm.stream()] == ["n1", "n2", "n3", "n4", "n5", "n6"]
+        assert qm._results == []
+        qm.reload()
+        assert len(qm.all_results()) == 6
@@ -0,0 +1,326 @@
+# Copyright (c) 2016-2021 Adobe Inc.  All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import json
+import threading
+import time
+
+import mock
+import pytest
+
+from conftest import MockResponse
+
+from umapi_client import Connection, RateLimiter, CircuitBreaker, RetryPolicy, BatchSizer, Action
+from umapi_client import UnavailableError, CircuitOpenError, ServerError, ArgumentError
+
+
+def test_rate_limiter_unlimited():
+    limiter = RateLimiter()
+    for _ in range(100):
+        assert limiter.reserve() == 0
+
+
+def test_rate_limiter_burst_then_paced():
+    limiter = RateLimiter(calls_per_second=10, burst=3)
+    waits = [limiter.reserve() for _ in range(5)]
+    assert waits[0:3] == [0, 0, 0]
+    assert 0.05 < waits[3] <= 0.1
+    assert 0.15 < waits[4] <= 0.2
+
+
+def test_rate_limiter_acquire_threads():
+    limiter = RateLimiter(calls_per_second=50, burst=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_rate_limiter_pause():
+    limiter = RateLimiter(calls_per_second=1000)
+    limiter.pause(0.2)
+    limiter.pause(0.1)
+    assert 0.1 < limiter.cooldown() <= 0.2
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.19
+    assert limiter.cooldown() == 0
+
+
+def test_rate_limiter_acquire_async():
+    limiter = RateLimiter(calls_per_second=1000)
+    limiter.pause(0.1)
+    start = time.monotonic()
+    asyncio.run(limiter.acquire_async())
+    assert time.monotonic() - start >= 0.09
+
+
+def test_rate_limiter_shared_retry_after(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get, \
+            mock.patch("umapi_client.connection.sleep"):
+        mock_get.return_value = MockResponse(429, headers={"Retry-After": "30"})
+        limiter = RateLimiter(calls_per_second=100)
+        conn1 = Connection(rate_limiter=limiter, **mock_connection_params)
+        conn2 = Connection(rate_limiter=limiter, **mock_connection_params)
+        conn1.retry_max_attempts = 1
+        pytest.raises(UnavailableError, conn1.make_call, "")
+        # the other connection now waits out the cooldown before calling
+        assert limiter.cooldown() > 29
+        with mock.patch("umapi_client.throttle.sleep") as mock_sleep:
+            mock_sleep.side_effect = lambda seconds: setattr(limiter, "_paused_until", 0.0)
+            mock_get.return_value = MockResponse(200, body=["test", "body"])
+            assert conn2.make_call("").json() == ["test", "body"]
+            assert mock_sleep.call_args[0][0] > 29
+
+
+def test_circuit_breaker_opens(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get, \
+            mock.patch("umapi_client.connection.sleep"):
+        mock_get.return_value = MockResponse(503)
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        conn = Connection(circuit_breaker=breaker, **mock_connection_params)
+        conn.retry_max_attempts = 10
+        with pytest.raises(UnavailableError) as excinfo:
+            conn.make_call("")
+        # retries stop as soon as the breaker opens
+        assert excinfo.value.attempts == 3
+        assert mock_get.call_count == 3
+        assert breaker.state == CircuitBreaker.OPEN
+        # later calls fail fast without touching the server
+        pytest.raises(CircuitOpenError, conn.make_call, "")
+        assert mock_get.call_count == 3
+
+
+def test_circuit_breaker_ignores_throttling(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get, \
+            mock.patch("umapi_client.connection.sleep"):
+        mock_get.return_value = MockResponse(429, headers={"Retry-After": "1"})
+        breaker = CircuitBreaker(failure_threshold=1)
+        conn = Connection(circuit_breaker=breaker, **mock_connection_params)
+        pytest.raises(UnavailableError, conn.make_call, "")
+        assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_half_open(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        conn = Connection(circuit_breaker=breaker, **mock_connection_params)
+        mock_get.return_value = MockResponse(500, text="500 test server failure")
+        pytest.raises(ServerError, conn.make_call, "")
+        assert breaker.state == CircuitBreaker.OPEN
+        # the probe finds the server down, so the call fails fast
+        mock_get.return_value = MockResponse(503)
+        pytest.raises(CircuitOpenError, conn.make_call, "")
+        assert mock_get.call_args[0][0] == "https://test/status"
+        assert breaker.state == CircuitBreaker.OPEN
+        # the probe finds the server live, so the call goes through and closes the circuit
+        mock_get.side_effect = [MockResponse(200, body={"state": "LIVE"}),
+                                MockResponse(200, body=["test", "body"])]
+        assert conn.make_call("").json() == ["test", "body"]
+        assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_trial_failure(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+        breaker.record_failure()
+        breaker.record_failure()
+        conn = Connection(circuit_breaker=breaker, **mock_connection_params)
+        mock_get.side_effect = [MockResponse(200, body={"state": "LIVE"}),
+                                MockResponse(500, text="500 test server failure")]
+        pytest.raises(ServerError, conn.make_call, "")
+        assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_circuit_breaker_trial_unexpected_error(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        conn = Connection(circuit_breaker=breaker, **mock_connection_params)
+        mock_get.side_effect = [MockResponse(200, body={"state": "LIVE"}), ValueError("unexpected")]
+        pytest.raises(ValueError, conn.make_call, "")
+        # the failed trial doesn't leave the breaker stuck half-open
+        assert breaker.state == CircuitBreaker.OPEN
+        mock_get.side_effect = [MockResponse(200, body={"state": "LIVE"}),
+                                MockResponse(200, body=["test", "body"])]
+        assert conn.make_call("").json() == ["test", "body"]
+        assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_trial_not_attempted(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        conn = Connection(circuit_breaker=breaker, **mock_connection_params)
+        mock_get.return_value = MockResponse(200, body={"state": "LIVE"})
+        # the trial's deadline has passed, so it is never attempted
+        pytest.raises(UnavailableError, conn.make_call, "", deadline=time.monotonic() - 1)
+        mock_get.side_effect = [MockResponse(200, body={"state": "LIVE"}), MockResponse(200, body=["test", "body"])]
+        assert conn.make_call("").json() == ["test", "body"]
+
+
+def test_retry_policy_exponential():
+    policy = RetryPolicy(max_attempts=4, first_delay=2, random_delay=0)
+    assert [policy.next_delay(n, 0, 503) for n in range(1, 5)] == [2, 4, 8, None]
+    # the server's advice wins
+    assert policy.next_delay(1, 0, 429, advised=30) == 30
+
+
+def test_retry_policy_full_jitter():
+    policy = RetryPolicy(max_attempts=10, first_delay=1, backoff=RetryPolicy.FULL_JITTER, max_delay=5)
+    for n in range(1, 10):
+        assert 0 <= policy.next_delay(n, 0, 'Error') <= min(pow(2, n - 1), 5)
+
+
+def test_retry_policy_decorrelated():
+    policy = RetryPolicy(max_attempts=10, first_delay=1, backoff=RetryPolicy.DECORRELATED, max_delay=20)
+    previous = None
+    for n in range(1, 10):
+        delay = policy.next_delay(n, 0, 504, previous=previous)
+        assert 1 <= delay <= min(3 * (previous or 1), 20)
+        previous = delay
+
+
+def test_retry_policy_rules():
+    pytest.raises(ArgumentError, RetryPolicy, backoff="linear")
+    policy = RetryPolicy(retry_codes=(429,), retry_connection_errors=False, honor_retry_after=False,
+                         first_delay=1, random_delay=0, max_elapsed=10)
+    assert policy.next_delay(1, 0, 503) is None
+    assert policy.next_delay(1, 0, 'Error') is None
+    assert policy.next_delay(1, 0, 429, advised=30) == 1
+    assert policy.next_delay(1, 9.5, 429) is None
+
+
+def test_retry_policy_connection(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get, \
+            mock.patch("umapi_client.connection.sleep") as mock_sleep:
+        mock_get.return_value = MockResponse(503)
+        policy = RetryPolicy(max_attempts=3, first_delay=1, random_delay=0)
+        conn = Connection(retry_policy=policy, **mock_connection_params)
+        pytest.raises(UnavailableError, conn.make_call, "")
+        assert mock_get.call_count == 3
+        assert [c[0][0] for c in mock_sleep.call_args_list] == [1, 2]
+
+
+def test_retry_policy_extra_codes(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get, \
+            mock.patch("umapi_client.connection.sleep"):
+        mock_get.side_effect = [MockResponse(500), MockResponse(200, {"result": "success"})]
+        policy = RetryPolicy(retry_codes=(500, 429), first_delay=1, random_delay=0)
+        conn = Connection(retry_policy=policy, **mock_connection_params)
+        assert conn.make_call("").status_code == 200
+        assert mock_get.call_count == 2
+        # codes that aren't listed still fail at once
+        mock_get.side_effect = [MockResponse(501)]
+        pytest.raises(ServerError, conn.make_call, "")
+
+
+def test_deadline_cuts_retries(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get, \
+            mock.patch("umapi_client.connection.sleep") as mock_sleep:
+        mock_get.return_value = MockResponse(429, headers={"Retry-After": "30"})
+        conn = Connection(**mock_connection_params)
+        with pytest.raises(UnavailableError) as excinfo:
+            conn.make_call("", deadline=time.monotonic() + 10)
+        # waiting 30 seconds would blow the deadline, so there's no retry
+        assert excinfo.value.attempts == 1
+        mock_sleep.assert_not_called()
+        assert mock_get.call_args[1]["timeout"] <= 10
+
+
+def test_deadline_passed(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get:
+        conn = Connection(**mock_connection_params)
+        with pytest.raises(UnavailableError) as excinfo:
+            conn.query_single("user", ["n1"], deadline=time.monotonic() - 1)
+        assert excinfo.value.attempts == 0
+        mock_get.assert_not_called()
+
+
+def test_batch_sizer_aimd():
+    sizer = BatchSizer(min_size=2, max_size=20, initial_size=8, hold_seconds=0)
+    assert sizer.size == 8
+    # partial batches don't grow the size
+    sizer.record_batch(5)
+    assert sizer.size == 8
+    for _ in range(3):
+        sizer.record_batch(sizer.size)
+    assert sizer.size == 11
+    sizer.record_response(1.0, True)
+    assert sizer.size == 11
+    sizer.record_response(1.0, False)
+    assert sizer.size == 5
+    for _ in range(3):
+        sizer.record_response(1.0, False)
+    assert sizer.size == 2
+    for _ in range(30):
+        sizer.record_batch(sizer.size)
+    assert sizer.size == 20
+    pytest.raises(ArgumentError, BatchSizer, min_size=5, max_size=4)
+    pytest.raises(ArgumentError, BatchSizer, decrease=1)
+
+
+def test_batch_sizer_slow_and_hold():
+    sizer = BatchSizer(slow_seconds=5, hold_seconds=60)
+    sizer.record_response(4.0, True)
+    assert sizer.size == 10
+    sizer.record_response(6.0, True)
+    assert sizer.size == 5
+    # bad responses during the hold period are part of the same episode
+    sizer.record_response(1.0, False)
+    assert sizer.size == 5
+
+
+def test_batch_sizer_connection(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.post") as mock_post, \
+            mock.patch("umapi_client.connection.sleep"):
+        mock_post.side_effect = [MockResponse(200, {"result": "success"}),
+                                 MockResponse(429, headers={"Retry-After": "0"}),
+                                 MockResponse(200, {"result": "success"})] + \
+                                [MockResponse(200, {"result": "success"})] * 10
+        sizer = BatchSizer(max_size=10, initial_size=4, hold_seconds=0)
+        conn = Connection(batch_sizer=sizer, **mock_connection_params)
+        actions = [Action(top="top{}".format(n)).append(a="a") for n in range(10)]
+        conn.execute_multiple(actions)
+        batch_sizes = [len(json.loads(c[1]["data"])) for c in mock_post.call_args_list]
+        assert batch_sizes == [4, 4, 4, 2]
+        # the first full batch grew the size to 5, the throttled call cut it to 2,
+        # and the second full batch (which finally went through) grew it to 3
+        assert sizer.size == 3
+        mock_post.reset_mock()
+        conn.execute_multiple(actions)
+        assert [len(json.loads(c[1]["data"])) for c in mock_post.call_args_list] == [3, 3, 3, 1]
+
+
+def test_batch_sizer_ignores_queries(mock_connection_params):
+    with mock.patch("umapi_client.connection.requests.Session.get") as mock_get, \
+            mock.patch("umapi_client.connection.sleep"):
+        mock_get.side_effect = [MockResponse(503, headers={"Retry-After": "0"}),
+                                MockResponse(200, {"result": "success"})]
+        sizer = BatchSizer(max_size=10, initial_size=4, hold_seconds=0)
+        conn = Connection(batch_sizer=sizer, **mock_connection_params)
+        # a query that had to be retried says nothing about how big action batches should be
+        conn.make_call("/users/org-id/0")
+        assert mock_get.call_count == 2
+        assert sizer.size == 4
@@ -18,13 +18,17 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from .api import Action, QuerySingle, QueryMultiple
-from .auth import JWTAuth, OAuthS2S
-from .connection import Connection
+from .api import Action, CoalescedAction, QuerySingle, QueryMultiple
+from .auth import JWTAuth, OAuthS2S, TokenCache, AuthRegistry
+from .connection import Connection, AsyncConnection
 from .error import BatchError, ClientError, RequestError, ServerError, UnavailableError, ArgumentError
+from .error import CircuitOpenError, ThrottledError
 from .functional import IdentityType, IfAlreadyExistsOption
 from .functional import UserAction, UserQuery, UsersQuery
 from .functional import GroupAction, GroupsQuery
+from .functional import MembershipPlanner, MembershipChange, PlannedAction
+from .journal import ActionJournal
+from .throttle import RateLimiter, CircuitBreaker, RetryPolicy, BatchSizer
 from .version import __version__
 import logging
 from logging import NullHandler
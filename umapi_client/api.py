@@ -18,6 +18,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
+from concurrent.futures import ThreadPoolExecutor
+
 from .connection import Connection
 
 
@@ -159,12 +162,88 @@ class Action:
         return maybe_split
 
 
+class CoalescedAction(Action):
+    """
+    An action made by merging the commands of several actions on the same object,
+    so they go to the server as one.  Errors that the server reports on its commands
+    are passed back to the actions the commands came from.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # for each command, the (action, step) it came from
+        self.sources = []
+
+    def add_commands(self, action):
+        """
+        Append the commands of another action on the same object.
+        :param action: the Action (or CoalescedAction) whose commands are added
+        :return: the coalesced action
+        """
+        if isinstance(action, CoalescedAction):
+            sources = action.sources
+        else:
+            sources = [(action, step) for step in range(len(action.commands))]
+        self.commands += action.commands
+        self.sources += sources
+        return self
+
+    def split(self, max_commands):
+        """
+        Split this action into coalesced actions with at most max_commands commands each.
+        Each of them passes errors back to the original actions.
+        :param max_commands: max number of commands allowed in any action
+        :return: the list of actions created from this one
+        """
+        self.split_actions = []
+        for start in range(0, len(self.commands), max_commands):
+            a_next = CoalescedAction(**self.frame)
+            a_next.commands = self.commands[start:start + max_commands]
+            a_next.sources = self.sources[start:start + max_commands]
+            self.split_actions.append(a_next)
+        return self.split_actions
+
+    def report_command_error(self, error_dict):
+        action, step = self.sources[error_dict["step"]]
+        action.report_command_error(dict(error_dict, step=step))
+
+
+def coalesce_actions(actions, max_commands):
+    """
+    Merge the actions in a list that have identical frames (that is, that act on the same
+    object) into one action, at the position of the first of them.  The commands keep
+    their order, and the merged action is split again if it gets longer than max_commands.
+    Note that this moves commands ahead of the commands on other objects that came between them.
+    :param actions: the list of Action objects
+    :param max_commands: max number of commands allowed in any action
+    :return: the list of actions to send instead
+    """
+    by_frame = {}
+    for action in actions:
+        key = json.dumps(action.frame, sort_keys=True, default=str)
+        by_frame.setdefault(key, []).append(action)
+    coalesced = []
+    for same_frame in by_frame.values():
+        if len(same_frame) == 1:
+            coalesced += same_frame
+            continue
+        merged = CoalescedAction(**same_frame[0].frame)
+        for action in same_frame:
+            merged.add_commands(action)
+        if len(merged.commands) > max_commands:
+            coalesced += merged.split(max_commands)
+        else:
+            coalesced.append(merged)
+    return coalesced
+
+
 class QueryMultiple:
     """
     A QueryMultiple runs a query against a connection.  The results can be iterated or fetched in bulk.
     """
-    def __init__(self, connection, object_type, url_params=None, query_params=None):
-        # type: (Connection, str, list, dict) -> None
+    def __init__(self, connection, object_type, url_params=None, query_params=None, page_concurrency=1,
+                 read_ahead=0):
+        # type: (Connection, str, list, dict, int, int) -> None
         """
         Provide the connection and query parameters when you create the query.
 
@@ -172,11 +251,17 @@ class QueryMultiple:
         :param object_type: The type of object being queried (e.g., "user" or "group")
         :param url_params: Query qualifiers that go in the URL path (e.g., a group name when querying users)
         :param query_params: Query qualifiers that go in the query string (e.g., a domain name)
+        :param page_concurrency: How many pages to fetch in parallel once the server has told us the page count
+        :param read_ahead: How many pages to fetch in the background, ahead of the page being consumed
         """
         self.conn = connection
         self.object_type = object_type
         self.url_params = url_params if url_params else []
         self.query_params = query_params if query_params else {}
+        self.page_concurrency = max(int(page_concurrency), 1)
+        self.read_ahead = max(int(read_ahead), 0)
+        self._prefetched = {}
+        self._executor = None
         self._results = []
         self._next_item_index = 0
         self._next_page_index = 0
@@ -192,6 +277,7 @@ class QueryMultiple:
         The results will contain any values on the server side that have changed since the last run.
         :return: None
         """
+        self._cancel_prefetch()
         self._results = []
         self._next_item_index = 0
         self._next_page_index = 0
@@ -203,17 +289,65 @@ class QueryMultiple:
 
     def _next_page(self):
         """
-        Fetch the next page of the query.
+        Fetch the next page of the query, and keep its results.
+        """
+        self._results += self._load_page()
+
+    def _load_page(self):
+        """
+        Fetch the next page of the query, and update the query's stats.
+        :return: the list of results on the page
         """
         if self._last_page_seen:
             raise StopIteration
         new, self._last_page_seen, self._total_count, self._page_count, self._page_number, self._page_size = \
-            self.conn.query_multiple(self.object_type, self._next_page_index, self.url_params, self.query_params)
+            self._fetch_page(self._next_page_index)
         self._next_page_index += 1
         if len(new) == 0:
             self._last_page_seen = True  # don't bother with next page if nothing was returned
+        if self._last_page_seen:
+            self._cancel_prefetch()
         else:
-            self._results += new
+            self._prefetch()
+        return new
+
+    def _fetch_page(self, page_index):
+        """
+        Get a page of the query, either from an earlier prefetch or by fetching it now.
+        """
+        future = self._prefetched.pop(page_index, None)
+        if future is not None:
+            return future.result()
+        return self.conn.query_multiple(self.object_type, page_index, self.url_params, self.query_params)
+
+    def _prefetch(self):
+        """
+        Start fetching the pages after the next one in the background.  If the server has told us
+        how many pages there are, we keep up to page_concurrency pages in flight.  Otherwise, we
+        speculatively read ahead the number of pages asked for, and drop any we fetched past the end.
+        """
+        window = self.read_ahead
+        if self._page_count > 0 and self.page_concurrency > max(window, 1):
+            window = self.page_concurrency
+        if window <= 0:
+            return
+        last_index = self._next_page_index + window
+        if self._page_count > 0:
+            last_index = min(last_index, self._page_count)
+        for page_index in range(self._next_page_index, last_index):
+            if page_index not in self._prefetched:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=window, thread_name_prefix="umapi-query")
+                self._prefetched[page_index] = self._executor.submit(
+                    self.conn.query_multiple, self.object_type, page_index, self.url_params, self.query_params)
+
+    def _cancel_prefetch(self):
+        for future in self._prefetched.values():
+            future.cancel()
+        self._prefetched = {}
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
 
     def _next_item(self):
         while self._next_item_index >= len(self._results):
@@ -256,6 +390,31 @@ class QueryMultiple:
         self._next_item_index = len(self._results)
         return list(self._results)
 
+    def iter_pages(self):
+        """
+        Run the query from the start, yielding each page of results as a list.
+        Unlike iteration and all_results, the query does not hold on to the pages it yields,
+        so memory use stays flat no matter how many results there are.  The counts from
+        stats() are updated as each page arrives.
+        Because the results are not kept, call reload() before using all_results afterward.
+        :return: a generator of lists of results
+        """
+        self.reload()
+        while not self._last_page_seen:
+            page = self._load_page()
+            if page:
+                yield page
+
+    def stream(self):
+        """
+        Run the query from the start, yielding each result in turn without keeping it.
+        See iter_pages for details.
+        :return: a generator of results
+        """
+        for page in self.iter_pages():
+            for value in page:
+                yield value
+
     def stats(self):
         return self._total_count, self._page_count, self._page_size, self._page_number
 
@@ -19,35 +19,83 @@
 # SOFTWARE.
 
 import datetime as dt
+import hashlib
+import inspect
+import json
+import os
+import threading
 import time
+from contextlib import contextmanager
 
-import jwt
 import requests
 import urllib.parse as urlparse
 import logging
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 logger = logging.getLogger(__name__)
 
 
 class AdobeAuthBase(requests.auth.AuthBase):
     def __init__(self, client_id, client_secret, auth_host, auth_endpoint,
-                 ssl_verify):
+                 ssl_verify, refresh_ratio=0.8, token_cache=None, expiry_margin=60):
         self.client_id = client_id
         self.client_secret = client_secret
         self.auth_host = auth_host
         self.auth_endpoint = auth_endpoint
         self.ssl_verify = ssl_verify
+        # once this fraction of the token's lifetime has passed, it is refreshed in the
+        # background while requests keep using it (None means wait until it expires)
+        self.refresh_ratio = refresh_ratio
+        # an optional TokenCache, to share tokens with other processes
+        self.token_cache = token_cache
+        # a token is treated as expired this many seconds early (but never before half its
+        # lifetime is up), so that it doesn't expire while a request using it is in flight
+        self.expiry_margin = expiry_margin
+        # wall-clock issue and expiry times, for logging and the token cache
+        self.issued_at = None
         self.expiry = None
+        # the decisions are made on the monotonic clock, so that clock adjustments can't
+        # make us refresh early or send an expired token
+        self.valid_until = None
+        self.refresh_at = None
         self.token = None
+        # token requests reuse the connection to the auth host
+        self.session = requests.Session()
+        # held while a refresh is in flight, so there is only ever one
+        self._refresh_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, *args, **kwargs):
+        """
+        Get the auth object in the process-wide registry for these credentials, creating
+        it if need be, so that every Connection using it shares one token.  The arguments
+        are those of the class constructor.
+        """
+        return registry.get(cls, *args, **kwargs)
 
     def set_expiry(self, expires_in):
-        expires_in = int(round(expires_in/1000))
-        self.expiry = dt.datetime.now() + dt.timedelta(seconds=expires_in)
+        # expires_in is in milliseconds
+        self._set_lifetime(expires_in / 1000)
+
+    def _set_lifetime(self, lifetime, age=0.0):
+        """
+        Record the expiry and refresh times of a new token.
+        :param lifetime: the token's lifetime in seconds
+        :param age: how many seconds ago the token was issued
+        """
+        now = time.monotonic()
+        self.issued_at = dt.datetime.now() - dt.timedelta(seconds=age)
+        self.expiry = self.issued_at + dt.timedelta(seconds=lifetime)
+        self.valid_until = now - age + lifetime - min(self.expiry_margin, lifetime / 2)
+        self.refresh_at = now - age + lifetime * self.refresh_ratio if self.refresh_ratio else None
 
     def __call__(self, r):
-        if self.token is None or self.expiry is None or \
-           self.expiry <= dt.datetime.now():
-            self.refresh_token()
+        self._ensure_token()
         r.headers['Content-type'] = 'application/json'
         r.headers['Accept'] = 'application/json'
         r.headers['x-api-key'] = self.client_id
@@ -55,6 +103,21 @@ class AdobeAuthBase(requests.auth.AuthBase):
         return r
     
     def refresh_token(self):
+        if self.token_cache is None:
+            self._request_token()
+            return
+        # holding the cache lock while we call the auth server means that when several
+        # processes need a token at once, only one of them asks for it
+        key = self.cache_key()
+        with self.token_cache.locked(key):
+            cached = self.token_cache.load(key)
+            if cached and self._use_cached_token(*cached):
+                logger.info("using cached auth token")
+                return
+            self._request_token()
+            self.token_cache.store(key, self.token, self.issued_at.timestamp(), self.expiry.timestamp())
+
+    def _request_token(self):
         logger.info("auth token is missing or expired - refreshing now")
         headers = {
             "Content-Type": "application/x-www-form-urlencoded",
@@ -63,8 +126,8 @@ class AdobeAuthBase(requests.auth.AuthBase):
 
         endpoint = f"https://{self.auth_host}/{self.auth_endpoint.strip('/')}/"
 
-        r = requests.post(endpoint, headers=headers, data=self.post_body(),
-                          verify=self.ssl_verify)
+        r = self.session.post(endpoint, headers=headers, data=self.post_body(),
+                              verify=self.ssl_verify)
 
         if r.status_code != 200:
             raise RuntimeError(f"Unable to authorize against {endpoint}:\n"
@@ -77,15 +140,91 @@ class AdobeAuthBase(requests.auth.AuthBase):
 
         self.token = r.json()['access_token']
 
+    def _use_cached_token(self, token, issued_at, expires_at):
+        """
+        Adopt a token from the cache, unless it is the one we already have, or it is
+        already due for refresh.
+        :return: whether the token was used
+        """
+        lifetime = expires_at - issued_at
+        age = max(time.time() - issued_at, 0.0)
+        due = min(lifetime * (self.refresh_ratio or 1), lifetime - min(self.expiry_margin, lifetime / 2))
+        if token == self.token or age >= due:
+            return False
+        self._set_lifetime(lifetime, age)
+        self.token = token
+        return True
+
+    def invalidate_token(self, token=None):
+        """
+        Stop using a token that the server has rejected, so the next request gets a new one.
+        :param token: the rejected token; if it has already been replaced, nothing is done.
+          None means the current token.
+        """
+        if token is not None and token != self.token:
+            return
+        logger.info("auth token was rejected - it will be refreshed")
+        self.valid_until = None
+        if self.token_cache is not None:
+            # don't let this process, or any other, pick it up from the cache again
+            key = self.cache_key()
+            with self.token_cache.locked(key):
+                self.token_cache.discard(key, self.token)
+
+    def cache_key(self):
+        """
+        The key for this integration's token in a TokenCache.
+        """
+        return "{}|{}|{}|{}".format(type(self).__name__, self.auth_host, self.client_id,
+                                    getattr(self, "org_id", ""))
+
+    def _token_valid(self):
+        return self.token is not None and self.valid_until is not None and self.valid_until > time.monotonic()
+
+    def _ensure_token(self):
+        """
+        Make sure there is a valid token.  If there isn't, get one, making sure that
+        only one thread calls the auth server while the others wait for its result.
+        If the token is valid but due for refresh, refresh it in the background.
+        """
+        if self._token_valid():
+            if self.refresh_at is not None and self.refresh_at <= time.monotonic():
+                self._refresh_in_background()
+            return
+        with self._refresh_lock:
+            # another thread may have done the refresh while we waited
+            if not self._token_valid():
+                self.refresh_token()
+
+    def _refresh_in_background(self):
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # a refresh is already in flight
+
+        def refresh():
+            try:
+                self.refresh_token()
+            except Exception as e:
+                logger.warning("Background token refresh failed (will try again): %s", e)
+                self.refresh_at = time.monotonic() + 30
+            finally:
+                self._refresh_lock.release()
+
+        logger.info("auth token is due for refresh - refreshing in the background")
+        threading.Thread(target=refresh, name="umapi-token-refresh", daemon=True).start()
+
 
 class OAuthS2S(AdobeAuthBase):
     def __init__(self, client_id, client_secret,
                  auth_host='ims-na1.adobelogin.com',
                  auth_endpoint='/ims/token/v2',
-                 ssl_verify=True):
+                 ssl_verify=True,
+                 refresh_ratio=0.8,
+                 token_cache=None,
+                 expiry_margin=60):
         logger.info("Auth type: OAuthS2S")
         super().__init__(
-            client_id, client_secret, auth_host, auth_endpoint, ssl_verify
+            client_id, client_secret, auth_host, auth_endpoint, ssl_verify,
+            refresh_ratio, token_cache, expiry_margin
         )
 
     def post_body(self):
@@ -97,20 +236,27 @@ class OAuthS2S(AdobeAuthBase):
         })
 
     def set_expiry(self, expires_in):
-        self.expiry = dt.datetime.now() + dt.timedelta(seconds=expires_in)
+        # expires_in is in seconds
+        self._set_lifetime(expires_in)
 
 
 class JWTAuth(AdobeAuthBase):
     def __init__(self, org_id, client_id, client_secret, tech_acct_id,
                  priv_key_data, ssl_verify=True,
                  auth_host='ims-na1.adobelogin.com',
-                 auth_endpoint='/ims/exchange/jwt/'):
+                 auth_endpoint='/ims/exchange/jwt/',
+                 refresh_ratio=0.8,
+                 token_cache=None,
+                 expiry_margin=60):
         logger.info("Auth type: JWTAuth")
         self.org_id = org_id
         self.tech_acct_id = tech_acct_id
         self.priv_key_data = priv_key_data
+        # the key object parsed from priv_key_data, loaded the first time we sign a JWT
+        self._private_key = None
         super().__init__(
-            client_id, client_secret, auth_host, auth_endpoint, ssl_verify
+            client_id, client_secret, auth_host, auth_endpoint, ssl_verify,
+            refresh_ratio, token_cache, expiry_margin
         )
 
     def jwt_token(self):
@@ -122,7 +268,22 @@ class JWTAuth(AdobeAuthBase):
             "https://" + self.auth_host + "/s/" + "ent_user_sdk": True
         }
 
-        return jwt.encode(payload, self.priv_key_data, algorithm='RS256')
+        # jwt and cryptography are slow to import, so they are only loaded if a JWT is needed
+        import jwt
+        return jwt.encode(payload, self.private_key(), algorithm='RS256')
+
+    def private_key(self):
+        """
+        The private key as a key object.  Parsing and checking an RSA key is costly,
+        so it is only done once and the result reused for every token.
+        """
+        if self._private_key is None:
+            from cryptography.hazmat.primitives import serialization
+            key_data = self.priv_key_data
+            if isinstance(key_data, str):
+                key_data = key_data.encode('utf-8')
+            self._private_key = serialization.load_pem_private_key(key_data, password=None)
+        return self._private_key
 
     def post_body(self):
         return urlparse.urlencode({
@@ -130,3 +291,118 @@ class JWTAuth(AdobeAuthBase):
             "client_secret": self.client_secret,
             "jwt_token": self.jwt_token()
         })
+
+
+class AuthRegistry:
+    """
+    Hands out one auth object per set of credentials, so connections for the same
+    integration share a single token and a single refresh schedule.
+    """
+
+    def __init__(self):
+        self._auths = {}
+        self._lock = threading.Lock()
+
+    def get(self, auth_class, *args, **kwargs):
+        """
+        Get the auth object for the given credentials, creating it if need be.
+        :param auth_class: the auth class (e.g., OAuthS2S or JWTAuth)
+        The remaining arguments are those of the auth_class constructor.  Arguments
+        given by position or by name, or left at their defaults, all find the same object.
+        """
+        bound = inspect.signature(auth_class).bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (auth_class,) + tuple(bound.arguments.items())
+        with self._lock:
+            auth = self._auths.get(key)
+            if auth is None:
+                auth = self._auths[key] = auth_class(*args, **kwargs)
+            return auth
+
+    def clear(self):
+        """
+        Forget all the auth objects handed out so far.
+        """
+        with self._lock:
+            self._auths.clear()
+
+
+# the registry used by AdobeAuthBase.shared
+registry = AuthRegistry()
+
+
+class TokenCache:
+    """
+    An on-disk cache of auth tokens, which lets processes that use the same integration
+    share a token instead of each getting its own.  Each token is kept in its own file
+    (readable only by its owner) in the cache directory, and access to it is serialized
+    across processes by locking a companion lock file.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: the directory to keep tokens in (created if need be)
+        """
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    @contextmanager
+    def locked(self, key):
+        """
+        Hold the lock on a key's token for the duration of the with block.
+        """
+        with open(self._path(key) + ".lock", "a+") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def load(self, key):
+        """
+        :return: tuple (token, issued_at, expires_at) for the key, or None if there is no unexpired token.
+          The times are seconds since the epoch.
+        """
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+            token, issued_at, expires_at = entry["access_token"], entry["issued_at"], entry["expires_at"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.debug("No usable cached token: %s", e)
+            return None
+        if expires_at <= time.time():
+            return None
+        return token, issued_at, expires_at
+
+    def discard(self, key, token):
+        """
+        Remove the key's token from the cache, if it is the given one.
+        """
+        entry = self.load(key)
+        if entry and entry[0] == token:
+            try:
+                os.remove(self._path(key))
+            except OSError as e:
+                logger.debug("Couldn't remove cached token: %s", e)
+
+    def store(self, key, token, issued_at, expires_at):
+        """
+        Save a token for the key, replacing any earlier one.
+        """
+        path = self._path(key)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"access_token": token, "issued_at": issued_at, "expires_at": expires_at}, f)
+        os.replace(temp_path, path)
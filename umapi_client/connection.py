@@ -18,14 +18,17 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import asyncio
 import json
 import logging
 import os
+import threading
 from email.utils import parsedate_tz, mktime_tz
 from platform import python_version, version as platform_version
-from random import randint
-from time import time, sleep, gmtime, strftime
+from time import time, sleep, gmtime, strftime, monotonic
 from uuid import uuid4
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import requests
 import io
@@ -33,6 +36,8 @@ import urllib.parse as urlparse
 
 from .auth import JWTAuth
 from .error import BatchError, UnavailableError, ClientError, RequestError, ServerError, ArgumentError
+from .error import ThrottledError
+from .throttle import RetryPolicy
 from .version import __version__ as umapi_version
 
 
@@ -48,11 +53,11 @@ class APIResult:
         self.timeout = timeout
         self.status_code = result.status_code if hasattr(result, 'status_code') else 'Error'
 
-    def check_result(self):
+    def check_result(self, retry_codes=()):
         if self.result.status_code in self.success_codes:
             self.success = True
             return self
-        if self.result.status_code in self.timeout_codes:
+        if self.result.status_code in self.timeout_codes or self.result.status_code in retry_codes:
             self.success = False
             self.timeout = self.get_timeout()
             return self
@@ -89,7 +94,23 @@ class Connection:
                  ssl_verify=True,
                  timeout=120.0,
                  max_retries=4,
-                 user_agent=None):
+                 user_agent=None,
+                 max_in_flight=1,
+                 pool_connections=10,
+                 pool_maxsize=None,
+                 pool_block=False,
+                 keep_alive=True,
+                 rate_limiter=None,
+                 circuit_breaker=None,
+                 retry_policy=None,
+                 requeue_throttled=False,
+                 eager=False,
+                 coalesce_actions=False,
+                 batch_sizer=None,
+                 linger=None,
+                 journal=None,
+                 request_ids=False,
+                 max_acknowledged=100000):
         """
         Open a connection for the given parameters that has the given options.
         The connection is authenticated and the auth token reused on all calls.
@@ -105,6 +126,42 @@ class Connection:
         :param test_mode: Whether to pass the server-side "test mode" flag when executing actions
         :param timeout: How many seconds to wait for server response (<= 0 or None means forever)
         :param ssl_verify:
+        :param max_in_flight: How many action batches may be sent to the server at the same time.  With more
+          than one in flight, batches are no longer applied in order: e.g., a GroupAction.create in one batch
+          and a UserAction.add_to_groups for that group in the next can race, so keep dependent actions in
+          separate execute calls
+        :param rate_limiter: (optional) a umapi_client.RateLimiter, which may be shared with other connections
+        :param circuit_breaker: (optional) a umapi_client.CircuitBreaker, which fails calls fast while the
+          server is down
+        :param retry_policy: (optional) a umapi_client.RetryPolicy for calls that time out or are throttled
+          (if given, max_retries is ignored)
+        :param requeue_throttled: Whether action batches that the server throttles should go back on the queue
+          (to be sent by a later execute call) rather than being retried after a wait
+        :param coalesce_actions: Whether to merge pending actions on the same object (e.g., several
+          actions for one user) into one action before sending them.  Their commands keep their
+          order, but move ahead of commands on other objects that were between them.
+        :param batch_sizer: (optional) a umapi_client.BatchSizer that adapts the number of actions per batch
+          to the server's responses (if given, it is used instead of throttle_actions)
+        :param linger: (optional) if given, a background thread sends queued actions once the oldest
+          has waited this many seconds, even if they don't fill a batch (full batches are sent at once,
+          as usual).  Call close (or use the connection as a context manager) to send what's left.
+        :param journal: (optional) a umapi_client.ActionJournal that records actions as they are queued
+          and done, so that a later run can resume the ones that weren't done
+        :param request_ids: Whether to give each action without a requestID a unique one when it is queued
+          (kept by the journal, if any), and skip sending actions that the server has already executed without
+          error (e.g., when the same Action objects are executed again after an error, only the failed ones go).  Only
+          the IDs the connection gave out are skipped: a requestID set by the caller is sent as is, every time.  This
+          can't be combined with coalesce_actions, since actions with different request IDs can't be merged.
+        :param max_acknowledged: How many acknowledged request IDs to remember (the oldest are forgotten first)
+
+        HTTP connection pooling options:
+        :param pool_connections: How many hosts to keep connection pools for
+        :param pool_maxsize: How many connections to keep open to each host (default: the larger of 10
+          and max_in_flight)
+        :param pool_block: Whether to wait for a free connection when a host's pool is in use,
+          rather than opening (and then discarding) an extra one
+        :param keep_alive: Whether to keep connections open between calls
+        :param eager: Whether to start a background warm_up as soon as the connection is created
         """
         self.logger = logging.getLogger(__name__)
         # for testing we mock the server, either by using an http relay
@@ -134,7 +191,33 @@ class Connection:
         self.throttle_actions = 10
         self.throttle_commands = 10
         self.throttle_groups = 10
+        # optional limits on the total commands and the JSON body size of a batch (None means no limit)
+        self.throttle_batch_commands = None
+        self.throttle_batch_bytes = None
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.retry_policy = retry_policy
+        self.requeue_throttled = requeue_throttled
+        self.coalesce_actions = coalesce_actions
+        self.batch_sizer = batch_sizer
+        self.linger = float(linger) if linger else None
+        self.journal = journal
+        if request_ids and coalesce_actions:
+            raise ArgumentError("request_ids and coalesce_actions can't both be used")
+        self.request_ids = request_ids
+        self.max_acknowledged = max_acknowledged
+        self._request_count = 0
+        self._call_count = 0
+        self._acknowledged = OrderedDict()
+        self._queue_not_before = 0.0
         self.action_queue = []
+        # when the oldest action in the queue was queued
+        self._queued_since = None
+        # held while the queue is changed, and signalled when it changes
+        self._queue_changed = threading.Condition(threading.RLock())
+        self._flusher = None
+        self._closed = False
         self.local_status = {"multiple-query-count": 0,
                              "single-query-count": 0,
                              "actions-sent": 0,
@@ -144,12 +227,124 @@ class Connection:
                               "endpoint": self.endpoint}
         self.sync_started = False
         self.sync_ended = False
+        self._lock = threading.Lock()
+        # held while batches from the queue are being sent
+        self._sending = threading.Lock()
+        self._batch_executor = None
         self.session = requests.Session()
+        if pool_maxsize is None:
+            pool_maxsize = max(10, self.max_in_flight)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                                pool_block=pool_block)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
         ua_string = "umapi-client/" + umapi_version + " Python/" + python_version() + " (" + platform_version() + ")"
         if user_agent and user_agent.strip():
             ua_string = user_agent.strip() + " " + ua_string
         self.session.headers["User-Agent"] = ua_string
         self.uuid = str(uuid4())
+        if eager:
+            self.warm_up(background=True)
+        if self.linger:
+            self._flusher = threading.Thread(target=self._flush_lingering, name="umapi-linger", daemon=True)
+            self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+            return
+        # don't hide the exception that is already on its way out
+        try:
+            self.close()
+        except Exception as e:
+            self.logger.error("Failed to send queued actions on close: %s", e)
+
+    def close(self, deadline=None):
+        """
+        Send any queued actions, stop the background flusher (if any), and release the
+        connection's threads, pooled connections, and journal file.
+        :param deadline: (optional) time.monotonic() value by which the queued actions must be sent
+          (those that can't be sent in time fail with UnavailableError)
+        :return: tuple: the number of actions left in the queue, that got sent, and that executed successfully.
+        """
+        with self._queue_changed:
+            self._closed = True
+            self._queue_changed.notify_all()
+        if self._flusher:
+            self._flusher.join()
+        try:
+            return self.execute_queued(deadline=deadline)
+        finally:
+            self._release()
+
+    def _release(self):
+        if self._batch_executor:
+            self._batch_executor.shutdown(wait=False)
+            self._batch_executor = None
+        self.session.close()
+        if self.journal:
+            self.journal.close()
+
+    def _flush_lingering(self):
+        """
+        The body of the background flusher: send queued actions once they have lingered long enough.
+        """
+        while self._wait_for_lingering():
+            # the queue isn't locked while we send, so producers aren't held up
+            try:
+                self.execute_queued()
+            except Exception as e:
+                # the errors are also recorded on the actions and in the local status
+                self.logger.error("Failed to send lingering actions: %s", e)
+
+    def _wait_for_lingering(self):
+        """
+        Wait until queued actions have lingered long enough to be sent, or the connection is closed.
+        :return: True if there are actions to send, False if the connection is closed
+        """
+        with self._queue_changed:
+            while not self._closed:
+                if not self.action_queue:
+                    self._queue_changed.wait()
+                    continue
+                wait = max(self._queued_since + self.linger - monotonic(), self.queue_delay())
+                if wait <= 0:
+                    return True
+                self._queue_changed.wait(wait)
+            return False
+
+    def warm_up(self, background=False):
+        """
+        Get ready for the first call ahead of time: fetch the auth token, and open
+        (and handshake) pooled connections to the server, one for each batch that
+        may be in flight.  This is best effort: failures are logged, not raised,
+        and whatever didn't get done is done by the first call as usual.
+        :param background: whether to do the work on a background thread
+        :return: the background thread if there is one, else None
+        """
+        if background:
+            thread = threading.Thread(target=self.warm_up, name="umapi-warm-up", daemon=True)
+            thread.start()
+            return thread
+        try:
+            # any auth object gets its token when it's applied to a request
+            self.auth(requests.Request("GET", self.endpoint).prepare())
+        except Exception as e:
+            self.logger.warning("Failed to get auth token during warm-up: %s", e)
+        # status calls go to the same host as other calls, so they fill its connection pool
+        connectors = [threading.Thread(target=self.status, kwargs={"remote": True})
+                      for _ in range(self.max_in_flight - 1)]
+        for thread in connectors:
+            thread.start()
+        self.status(remote=True)
+        for thread in connectors:
+            thread.join()
+        return None
 
     def status(self, remote=False):
         """
@@ -191,33 +386,44 @@ class Connection:
                                       "status": "Unreachable at: " + strftime("%d %b %Y %H:%M:%S +0000", gmtime())}
         return self.local_status, self.server_status
 
-    def query_single(self, object_type, url_params, query_params=None):
-        # type: (str, list, dict) -> dict
+    def query_single(self, object_type, url_params, query_params=None, deadline=None):
+        # type: (str, list, dict, float) -> dict
         """
         Query for a single object.
         :param object_type: string query type (e.g., "users" or "groups")
         :param url_params: required list of strings to provide as additional URL components
         :param query_params: optional dictionary of query options
+        :param deadline: optional time.monotonic() value by which the query must be done
         :return: the found object (a dictionary), which is empty if none were found
         """
+        self.local_status["single-query-count"] += 1
+        query_path = self._single_query_path(object_type, url_params, query_params)
+        try:
+            result = self.make_call(query_path, deadline=deadline)
+        except RequestError as re:
+            return self._single_query_not_found(re, object_type, url_params, query_params)
+        return self._single_query_value(result, object_type, url_params, query_params)
+
+    def _single_query_path(self, object_type, url_params, query_params):
         # Server API convention (v2) is that the pluralized object type goes into the endpoint
         # but the object type is the key in the response dictionary for the returned object.
-        self.local_status["single-query-count"] += 1
         query_type = object_type + "s"  # poor man's plural
         query_path = "/organizations/{}/{}".format(self.org_id, query_type)
         for component in url_params if url_params else []:
             query_path += "/" + urlparse.quote(component, safe='/@')
         if query_params: query_path += "?" + urlparse.urlencode(query_params)
-        try:
-            result = self.make_call(query_path)
-            body = result.json()
-        except RequestError as re:
-            if re.result.status_code == 404:
-                self.logger.debug("Ran %s query: %s %s (0 found)",
-                             object_type, url_params, query_params)
-                return {}
-            else:
-                raise re
+        return query_path
+
+    def _single_query_not_found(self, re, object_type, url_params, query_params):
+        if re.result.status_code == 404:
+            self.logger.debug("Ran %s query: %s %s (0 found)",
+                         object_type, url_params, query_params)
+            return {}
+        else:
+            raise re
+
+    def _single_query_value(self, result, object_type, url_params, query_params):
+        body = result.json()
         if body.get("result") == "success":
             value = body.get(object_type, {})
             self.logger.debug("Ran %s query: %s %s (1 found)", object_type, url_params, query_params)
@@ -225,8 +431,8 @@ class Connection:
         else:
             raise ClientError("OK status but no 'success' result", result)
 
-    def query_multiple(self, object_type, page=0, url_params=None, query_params=None):
-        # type: (str, int, list, dict) -> tuple
+    def query_multiple(self, object_type, page=0, url_params=None, query_params=None, deadline=None):
+        # type: (str, int, list, dict, float) -> tuple
         """
         Query for a page of objects.  Defaults to the (0-based) first page.
         Sadly, the sort order is undetermined.
@@ -234,12 +440,22 @@ class Connection:
         :param page: numeric page (0-based) of results to get (up to 200 in a page)
         :param url_params: optional list of strings to provide as additional URL components
         :param query_params: optional dictionary of query options
+        :param deadline: optional time.monotonic() value by which the query must be done
         :return: tuple (list of returned dictionaries (one for each query result), bool for whether this is last page)
         """
+        with self._lock:
+            self.local_status["multiple-query-count"] += 1
+        query_path = self._multiple_query_path(object_type, page, url_params, query_params)
+        try:
+            result = self.make_call(query_path, deadline=deadline)
+        except RequestError as re:
+            return self._multiple_query_not_found(re, object_type, url_params, query_params)
+        return self._multiple_query_values(result, object_type, page, url_params, query_params)
+
+    def _multiple_query_path(self, object_type, page, url_params, query_params):
         # As of 2017-10-01, we are moving to to different URLs for user and user-group queries,
         # and these endpoints have different conventions for pagination.  For the time being,
         # we are also preserving the more general "group" query capability.
-        self.local_status["multiple-query-count"] += 1
         if object_type in ("user", "group"):
             query_path = "/{}s/{}/{:d}".format(object_type, self.org_id, page)
             if url_params: query_path += "/" + "/".join([urlparse.quote(c) for c in url_params])
@@ -251,17 +467,18 @@ class Connection:
             if query_params: query_path += "&" + urlparse.urlencode(query_params)
         else:
             raise ArgumentError("Unknown query object type ({}): must be 'user' or 'group'".format(object_type))
-        try:
-            result = self.make_call(query_path)
-            body = result.json()
-        except RequestError as re:
-            if re.result.status_code == 404:
-                self.logger.debug("Ran %s query: %s %s (0 found)",
-                             object_type, url_params, query_params)
-                return [], True, 0, 0, 0, 0
-            else:
-                raise re
+        return query_path
+
+    def _multiple_query_not_found(self, re, object_type, url_params, query_params):
+        if re.result.status_code == 404:
+            self.logger.debug("Ran %s query: %s %s (0 found)",
+                         object_type, url_params, query_params)
+            return [], True, 0, 0, 0, 0
+        else:
+            raise re
 
+    def _multiple_query_values(self, result, object_type, page, url_params, query_params):
+        body = result.json()
         headers = {k.lower(): v for k, v in result.headers.items()}
         total_count = headers.get("x-total-count", "0")
         page_count = headers.get("x-page-count", "0")
@@ -307,14 +524,15 @@ class Connection:
         """
         return self.execute_multiple([action], immediate=immediate)
 
-    def execute_queued(self):
+    def execute_queued(self, deadline=None):
         """
         Force execute any queued commands.
+        :param deadline: optional time.monotonic() value by which the batches must be done
         :return: the number of actions left in the queue, that got sent, and that executed successfully.
         """
-        return self.execute_multiple([], immediate=True)
+        return self.execute_multiple([], immediate=True, deadline=deadline)
 
-    def execute_multiple(self, actions, immediate=True):
+    def execute_multiple(self, actions, immediate=True, deadline=None):
         """
         Execute multiple Actions (each containing commands on a single object).
         Normally, the actions are sent for execution immediately (possibly preceded
@@ -337,12 +555,356 @@ class Connection:
 
         :param actions: the list of Action objects to be executed
         :param immediate: whether to immediately send them to the server
+        :param deadline: optional time.monotonic() value by which the batches must be done (batches that
+          can't be sent in time fail with UnavailableError)
         :return: tuple: the number of actions in the queue, that got sent, and that executed successfully.
         """
-        # throttling part 1: split up each action into smaller actions, as needed
-        # optionally split large lists of groups in add/remove commands (if action supports it)
+        with self._queue_changed:
+            self._queue_actions(actions)
+            if not (immediate or self._make_batches(self.action_queue, immediate)[0]):
+                try:
+                    return self._record_execution([], [])
+                finally:
+                    self._queue_changed.notify_all()
+        # only one thread sends at a time, so batches go in queue order; but the queue
+        # isn't locked while they are sent, so other threads can keep queueing
+        with self._sending:
+            with self._queue_changed:
+                batches = self._take_batches(immediate)
+            outcomes = self._dispatch_batches(batches, deadline)
+            with self._queue_changed:
+                try:
+                    return self._record_execution(batches, outcomes)
+                finally:
+                    self._queue_changed.notify_all()
+
+    def _queue_actions(self, actions):
+        """
+        Add new actions to the end of the queue.
+        :param actions: the list of Action objects to be executed
+        """
+        self.action_queue = self._pending_actions(actions)
+        if self.action_queue and self._queued_since is None:
+            self._queued_since = monotonic()
+        self.local_status["actions-queued"] = len(self.action_queue)
+
+    def _take_batches(self, immediate):
+        """
+        Take the batches to be sent off the front of the queue.
+        :param immediate: whether a partial batch should be sent
+        :return: the list of batches to send
+        """
+        # throttling part 2: execute the action list in batches, as needed
+        batches, actions = self._make_batches(self.action_queue, immediate)
+        if not actions:
+            self._queued_since = None
+        elif batches:
+            # batches are taken from the front of the queue, so what's left came later
+            self._queued_since = monotonic()
+        self.action_queue = actions
+        self.local_status["actions-queued"] = len(actions)
+        return batches
+
+    def _pending_actions(self, actions):
+        """
+        The actions to be sent: those already queued, followed by the new ones (split as needed).
+        If the connection coalesces actions, those on the same object are merged.
+        """
+        return self._coalesce(self.action_queue + self._admit(actions))
+
+    def _admit(self, actions):
+        """
+        Prepare new actions for the queue: give them request IDs (if the connection assigns them),
+        split them as needed, drop any the server has already acknowledged, and journal the rest.
+        :param actions: the list of Action objects to be executed
+        :return: the list of Action objects to queue
+        """
+        if self.request_ids:
+            for action in actions:
+                if "requestID" not in action.frame:
+                    with self._lock:
+                        self._request_count += 1
+                        action.frame["requestID"] = "{}_{}".format(self.uuid, self._request_count)
+        actions = self._unacknowledged(self._split_actions(actions))
+        if self.journal:
+            self.journal.record_queued(actions)
+        return actions
+
+    def _unacknowledged(self, actions):
+        """
+        Drop the actions whose request IDs the server has already acknowledged.
+        """
+        if not self.request_ids:
+            return actions
+        with self._lock:
+            fresh = [a for a in actions if self._assigned_id(a) not in self._acknowledged]
+        if len(fresh) < len(actions):
+            self.logger.info("Skipping %d actions that the server has already acknowledged.",
+                             len(actions) - len(fresh))
+        return fresh
+
+    def _acknowledge(self, actions):
+        """
+        Remember the request IDs of actions that the server has executed without error,
+        forgetting the oldest if need be.
+        """
+        with self._lock:
+            for action in actions:
+                request_id = self._assigned_id(action)
+                if request_id is not None:
+                    self._acknowledged[request_id] = True
+                    self._acknowledged.move_to_end(request_id)
+            while len(self._acknowledged) > self.max_acknowledged:
+                self._acknowledged.popitem(last=False)
+
+    def _assigned_id(self, action):
+        """
+        The request ID of an action, if the connection assigned it (callers may reuse their own,
+        e.g. to correlate the actions of a run, so those can't be told apart).
+        :return: the request ID, or None
+        """
+        request_id = action.frame.get("requestID")
+        if isinstance(request_id, str) and request_id.startswith(self.uuid + "_"):
+            return request_id
+        return None
+
+    def _journal_done(self, batches, outcomes):
+        """
+        Mark the batches that the server answered as done in the journal.  Batches that
+        failed any other way (e.g., we couldn't get an auth token, or the connection broke)
+        may never have reached the server, so they stay pending.
+        """
+        if self.journal:
+            for batch, outcome in zip(batches, outcomes):
+                if isinstance(outcome, (int, RequestError, ServerError, ClientError)):
+                    self.journal.record_done(batch)
+
+    def resume(self):
+        """
+        Queue the actions from the journal file that it doesn't show as done (for example,
+        because the process that queued them died), to be sent by the next execute call.
+        Each of them is only queued once, however often this is called.
+        :return: the number of actions queued
+        """
+        if not self.journal:
+            raise ArgumentError("There is no journal to resume from")
+        actions = self._unacknowledged(self.journal.pending_actions())
+        self._requeue(actions)
+        return len(actions)
+
+    def _coalesce(self, actions):
+        """
+        If the connection coalesces actions, merge those on the same object.
+        """
+        if self.coalesce_actions:
+            # imported here because the api module imports this one
+            from .api import coalesce_actions
+            count = len(actions)
+            actions = coalesce_actions(actions, self.throttle_commands)
+            if len(actions) < count:
+                self.logger.debug("Coalesced %d actions into %d.", count, len(actions))
+        return actions
+
+    def execute_stream(self, actions, deadline=None):
+        """
+        Execute actions pulled lazily from an iterable (such as a generator reading a file),
+        so that only a bounded window of them is held at once, however many there are.
+        Any actions already queued are sent first.  Actions are pulled until there are
+        enough to fill max_in_flight batches, those batches are executed, and so on.
+
+        This is a generator: it yields a tuple for each batch as it completes, giving the
+        number of actions sent, the number that executed successfully, and the exception
+        that failed the batch (or None).  As always, command errors are reported on the
+        Action objects.  If you stop iterating early, the actions already pulled from the
+        iterable but not sent are left on the queue.
+
+        :param actions: an iterable of Action objects
+        :param deadline: optional time.monotonic() value by which the batches must be done (batches that
+          can't be sent in time fail with UnavailableError)
+        """
+        source, pending, exhausted = iter(actions), self._take_queue(), False
+        try:
+            while pending or not exhausted:
+                pending, exhausted = self._fill_window(source, pending)
+                batches, pending = self._make_batches(pending, immediate=exhausted)
+                if not batches:
+                    continue
+                delay = self._stream_delay(deadline)
+                if delay is None:
+                    outcomes = self._missed_deadline(batches)
+                else:
+                    if delay > 0:
+                        sleep(delay)
+                    with self._sending:
+                        outcomes = self._dispatch_batches(batches, deadline)
+                results, pending = self._stream_results(batches, outcomes, pending)
+                yield from results
+        finally:
+            self._requeue(pending)
+
+    def _stream_delay(self, deadline):
+        """
+        How long a stream has to wait before sending its next batches (see queue_delay).
+        :param deadline: optional time.monotonic() value by which the batches must be done
+        :return: the number of seconds to wait, or None if the wait would go past the deadline
+        """
+        delay = self.queue_delay()
+        if delay > 0 and deadline is not None and monotonic() + delay >= deadline:
+            self.logger.warning("UMAPI deadline would pass while waiting to send...giving up")
+            return None
+        return delay
+
+    def _missed_deadline(self, batches):
+        """
+        The outcomes for batches that can't be sent before the deadline.
+        """
+        return [UnavailableError(0, 0, None) for _ in batches]
+
+    def _take_queue(self):
+        """
+        Remove all the actions from the queue, for streaming.
+        :return: the list of queued actions
+        """
+        with self._queue_changed:
+            actions, self.action_queue, self._queued_since = self.action_queue, [], None
+            self.local_status["actions-queued"] = 0
+            return actions
+
+    def _requeue(self, actions):
+        """
+        Put actions that a stream pulled but didn't send at the front of the queue.
+        """
+        if not actions:
+            return
+        with self._queue_changed:
+            self.action_queue = actions + self.action_queue
+            self._queued_since = self._queued_since or monotonic()
+            self.local_status["actions-queued"] = len(self.action_queue)
+            self._queue_changed.notify_all()
+
+    def _max_batch_actions(self):
+        return self.batch_sizer.size if self.batch_sizer else self.throttle_actions
+
+    def _fill_window(self, source, pending):
+        """
+        Pull actions from a stream until there are enough to fill max_in_flight batches.
+        :param source: the iterator of Action objects
+        :param pending: the list of actions pulled but not yet sent
+        :return: tuple: the list of pending actions (split and coalesced as needed), and
+          whether the iterator is exhausted
+        """
+        window = self.max_in_flight * self._max_batch_actions()
+        pulled = []
+        while len(pending) + len(pulled) < window:
+            try:
+                pulled.append(next(source))
+            except StopIteration:
+                return self._coalesce(pending + self._admit(pulled)), True
+        return self._coalesce(pending + self._admit(pulled)), False
+
+    def _stream_results(self, batches, outcomes, pending):
+        """
+        Tally the outcomes of streamed batches.  Throttled batches go back in front of the pending actions.
+        :return: tuple: the list of results to yield, and the list of pending actions
+        """
+        self._journal_done(batches, outcomes)
+        results, requeued = [], []
+        sent = completed = 0
+        for batch, outcome in zip(batches, outcomes):
+            if isinstance(outcome, ThrottledError):
+                requeued += batch
+            elif isinstance(outcome, BaseException):
+                sent += len(batch)
+                results.append((len(batch), 0, outcome))
+            else:
+                sent += len(batch)
+                completed += outcome
+                results.append((len(batch), outcome, None))
+        with self._lock:
+            self.local_status["actions-sent"] += sent
+            self.local_status["actions-completed"] += completed
+        return results, requeued + pending
+
+    def _make_batches(self, actions, immediate):
+        """
+        Divide the actions into batches that can be sent, leaving any remainder queued.
+        Batches are filled in order, each taking as many actions as fit within the limits
+        on actions, commands, and body size per batch.
+        :param actions: the list of Action objects to be executed
+        :param immediate: whether a partial batch should be sent
+        :return: tuple: the list of batches to send, and the list of actions left over
+        """
+        batches = []
+        while actions:
+            size, full = self._next_batch_size(actions)
+            if not (full or immediate):
+                break
+            batch, actions = actions[0:size], actions[size:]
+            self.logger.debug("Executing %d actions (%d remaining).", len(batch), len(actions))
+            batches.append(batch)
+        return batches, actions
+
+    def _next_batch_size(self, actions):
+        """
+        How many of the actions (from the start of the list) go in the next batch.
+        :param actions: the non-empty list of Action objects to be executed
+        :return: tuple: the number of actions, and whether the batch is full
+        """
+        max_actions = self._max_batch_actions()
+        max_commands, max_bytes = self.throttle_batch_commands, self.throttle_batch_bytes
+        commands = 0
+        # the body is a JSON list: brackets around the actions, with ", " between them
+        body_bytes = 2
+        for count, action in enumerate(actions):
+            if count == max_actions:
+                return count, True
+            commands += len(action.commands)
+            if max_bytes:
+                body_bytes += len(json.dumps(action.wire_dict())) + (2 if count else 0)
+            if (max_commands and commands > max_commands) or (max_bytes and body_bytes > max_bytes):
+                if count == 0:
+                    # this action is too big for any batch, so it has to go by itself
+                    self.logger.warning("Action %s exceeds the batch limits; sending it alone.", action.frame)
+                    return 1, True
+                return count, True
+        full = len(actions) == max_actions or (max_commands and commands == max_commands)
+        return len(actions), bool(full)
+
+    def _dispatch_batches(self, batches, deadline=None):
+        """
+        Execute the batches, with up to max_in_flight of them in progress at once.
+        Exceptions are collected rather than raised.
+        :param batches: list of lists of Action objects
+        :param deadline: optional time.monotonic() value by which the batches must be done
+        :return: list, in batch order, of the count of successful actions or the exception for each batch
+        """
+        if self.max_in_flight > 1 and len(batches) > 1:
+            # the lock keeps callers that race here from each creating a pool
+            with self._lock:
+                if self._batch_executor is None:
+                    self._batch_executor = ThreadPoolExecutor(max_workers=self.max_in_flight,
+                                                              thread_name_prefix="umapi-batch")
+                executor = self._batch_executor
+            futures = [executor.submit(self._execute_batch, batch, deadline) for batch in batches]
+            calls = [future.result for future in futures]
+        else:
+            calls = [lambda batch=batch: self._execute_batch(batch, deadline) for batch in batches]
+        outcomes = []
+        for call in calls:
+            try:
+                outcomes.append(call())
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+
+    def _split_actions(self, actions):
+        """
+        Throttling part 1: split up each action into smaller actions, as needed.
+        Optionally split large lists of groups in add/remove commands (if action supports it).
+        :param actions: the list of Action objects to be executed
+        :return: the list of (possibly split) Action objects that should be sent
+        """
         split_actions = []
-        exceptions = []
         for a in actions:
             if len(a.commands) == 0:
                 self.logger.warning("Sending action with no commands: %s", a.frame)
@@ -357,30 +919,58 @@ class Connection:
             if len(a.commands) > self.throttle_commands:
                 self.logger.debug("Throttling action %s to have a maximum of %d commands.",
                                                   a.frame, self.throttle_commands)
-                split_actions += a.split(self.throttle_commands)
+                pieces = a.split(self.throttle_commands)
+                if self.request_ids:
+                    # the pieces are the same each time, so numbering them keeps their IDs stable
+                    for n, piece in enumerate(pieces):
+                        piece.frame["requestID"] = "{}.{}".format(a.frame["requestID"], n)
+                split_actions += pieces
             else:
                 split_actions.append(a)
-        actions = self.action_queue + split_actions
-        # throttling part 2: execute the action list in batches, as needed
+        return split_actions
+
+    def _record_execution(self, batches, outcomes):
+        """
+        Tally the outcomes of executing batches and update the local status counts.
+        Batches that were throttled go back on the front of the queue, to be sent
+        once the server's advised wait is over.
+        :param batches: the list of batches that were executed
+        :param outcomes: for each batch, the count of successful actions or the exception raised
+        :return: tuple: the number of actions in the queue, that got sent, and that executed successfully.
+        """
+        self._journal_done(batches, outcomes)
         sent = completed = 0
-        batch_size = self.throttle_actions
-        min_size = 1 if immediate else batch_size
-        while len(actions) >= min_size:
-            batch, actions = actions[0:batch_size], actions[batch_size:]
-            self.logger.debug("Executing %d actions (%d remaining).", len(batch), len(actions))
-            sent += len(batch)
-            try:
-                completed += self._execute_batch(batch)
-            except Exception as e:
-                exceptions.append(e)
-        self.action_queue = actions
-        self.local_status["actions-queued"] = queued = len(actions)
+        exceptions = []
+        requeued = []
+        for batch, outcome in zip(batches, outcomes):
+            if isinstance(outcome, ThrottledError):
+                requeued += batch
+            elif isinstance(outcome, BaseException):
+                sent += len(batch)
+                exceptions.append(outcome)
+            else:
+                sent += len(batch)
+                completed += outcome
+        if requeued:
+            self.logger.info("Requeued %d throttled actions, to be sent in %d seconds.",
+                             len(requeued), self.queue_delay())
+            self.action_queue = requeued + self.action_queue
+            self._queued_since = self._queued_since or monotonic()
+        self.local_status["actions-queued"] = queued = len(self.action_queue)
         self.local_status["actions-sent"] += sent
         self.local_status["actions-completed"] += completed
         if exceptions:
             raise BatchError(exceptions, queued, sent, completed)
         return queued, sent, completed
 
+    def queue_delay(self):
+        """
+        How long until queued actions can be sent.  This is only ever non-zero when
+        throttled batches are requeued rather than retried (see requeue_throttled).
+        :return: the number of seconds to wait before calling execute_queued
+        """
+        return max(self._queue_not_before - monotonic(), 0.0)
+
     def start_sync(self):
         """Signal the beginning of a sync operation
         Sends a header with the first batch of UMAPI actions"""
@@ -391,24 +981,58 @@ class Connection:
         Sends a header with the next batch of UMAPI actions"""
         self.sync_ended = True
 
-    def _execute_batch(self, actions):
+    def _execute_batch(self, actions, deadline=None):
         """
         Execute a single batch of Actions.
         For each action that has a problem, we annotate the action with the
         error information for that action, and we return the number of
         successful actions in the batch.
         :param actions: the list of Action objects to be executed
+        :param deadline: optional time.monotonic() value by which the call must be done
         :return: count of successful actions
         """
-        wire_form = [a.wire_dict() for a in actions]
+        self._check_throttled()
+        try:
+            result = self.make_call(self._batch_path(), [a.wire_dict() for a in actions], deadline=deadline,
+                                    raise_throttled=self.requeue_throttled, batch=True)
+        except ThrottledError as e:
+            self._defer_queue(e.retry_after)
+            raise
+        return self._batch_completed(actions, result)
+
+    def _check_throttled(self):
+        """
+        When requeueing throttled batches, don't send any batch until the server's advised wait is over.
+        """
+        if self.requeue_throttled:
+            delay = self.queue_delay()
+            if delay > 0:
+                raise ThrottledError(delay, None)
+
+    def _defer_queue(self, seconds):
+        with self._lock:
+            self._queue_not_before = max(self._queue_not_before, monotonic() + seconds)
+
+    def _batch_path(self):
         if self.test_mode:
-            result = self.make_call("/action/%s?testOnly=true" % self.org_id, wire_form)
-        else:
-            result = self.make_call("/action/%s" % self.org_id, wire_form)
+            return "/action/%s?testOnly=true" % self.org_id
+        return "/action/%s" % self.org_id
+
+    def _batch_completed(self, actions, result):
+        """
+        Annotate the actions in a batch with the errors reported by the server.
+        :param actions: the list of Action objects that were sent
+        :param result: the requests.result object for the call
+        :return: count of successful actions
+        """
+        if self.batch_sizer:
+            self.batch_sizer.record_batch(len(actions))
         body = result.json()
         if body.get("errors", None) is None:
             if body.get("result") != "success":
                 self.logger.warning("Server action result: no errors, but no success:\n%s", body)
+            if self.request_ids:
+                self._acknowledge(actions)
             return len(actions)
         try:
             if body.get("result") == "success":
@@ -417,75 +1041,412 @@ class Connection:
                 actions[error["index"]].report_command_error(error)
         except:
             raise ClientError(str(body), result)
+        if self.request_ids:
+            # actions with errors can be tried again
+            failed = {error["index"] for error in body["errors"]}
+            self._acknowledge([a for i, a in enumerate(actions) if i not in failed])
         return body.get("completed", 0)
 
-    def make_call(self, path, body=None, delete=False):
+    def make_call(self, path, body=None, delete=False, deadline=None, raise_throttled=False, batch=False):
         """
         Make a single UMAPI call with error handling and retry on temporary failure.
         :param path: the string endpoint path for the call
         :param body: (optional) list of dictionaries to be serialized into the request body
+        :param deadline: (optional) time.monotonic() value by which the call must be done, including retries
+        :param raise_throttled: (optional) raise ThrottledError, rather than waiting, if the server throttles us
+        :param batch: (optional) whether the call executes a batch of actions, so its responses count
+          towards the batch size (if there is a batch_sizer)
         :return: the requests.result object (on 200 response), raise error otherwise
         """
-        extra_headers = {"X-Request-Id": f"{self.uuid}_{int(datetime.now().timestamp()*1000)}"}
+        trial = self.circuit_breaker.before_call(self) if self.circuit_breaker else False
+        try:
+            return self._call_with_retries(self._prepare_call(path, body, delete), deadline, raise_throttled, batch)
+        finally:
+            if trial:
+                self.circuit_breaker.end_trial()
+
+    def _call_with_retries(self, call, deadline, raise_throttled, batch=False):
+        """
+        Make attempts at a call until one succeeds or we have to give up.  See make_call.
+        :param call: the function from _prepare_call
+        """
+        policy = self._retry_policy()
+        start_time = monotonic()
+        checked_result = retry_wait = None
+        num_attempts = 0
+        while self._before_deadline(deadline):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            num_attempts += 1
+            result, checked_result = self._attempt_call(call, num_attempts, self._attempt_timeout(deadline),
+                                                        policy.retry_codes, batch)
+            if checked_result.success:
+                return result
+            retry_wait = self._next_retry_wait(policy, num_attempts, start_time, checked_result, retry_wait, deadline)
+            if raise_throttled and self._is_throttled(checked_result):
+                raise ThrottledError(retry_wait if retry_wait is not None else max(checked_result.timeout or 0, 0),
+                                     checked_result.result)
+            if retry_wait is None:
+                break
+            if retry_wait > 0:
+                self.logger.warning("waiting %d seconds to continue...", retry_wait)
+                sleep(retry_wait)
+            else:
+                self.logger.warning("Immediate retry...")
+        raise self._unavailable(start_time, num_attempts, checked_result)
+
+    def _prepare_call(self, path, body=None, delete=False):
+        """
+        Build the function that sends a single attempt of a UMAPI call.
+        :param path: the string endpoint path for the call
+        :param body: (optional) list of dictionaries to be serialized into the request body
+        :param delete: whether this is a DELETE request
+        :return: a function of the request timeout that makes the request and returns the requests.result
+        """
         # if the sync_started or sync_ended flags are set, send a header for any type of call
-        if self.sync_started:
-            self.logger.info("Sending start_sync signal")
-            extra_headers['Pragma'] = 'umapi-sync-start'
-            self.sync_started = False
-        elif self.sync_ended:
-            self.logger.info("Sending end_sync signal")
-            extra_headers['Pragma'] = 'umapi-sync-end'
-            self.sync_ended = False
+        # (the lock makes sure only one of several concurrent calls sends it)
+        with self._lock:
+            # the count keeps the ids of concurrent calls made in the same millisecond distinct
+            self._call_count += 1
+            extra_headers = {"X-Request-Id": "{}_{}_{}".format(
+                self.uuid, int(datetime.now().timestamp()*1000), self._call_count)}
+            if self.sync_started:
+                self.logger.info("Sending start_sync signal")
+                extra_headers['Pragma'] = 'umapi-sync-start'
+                self.sync_started = False
+            elif self.sync_ended:
+                self.logger.info("Sending end_sync signal")
+                extra_headers['Pragma'] = 'umapi-sync-end'
+                self.sync_ended = False
         if body:
             request_body = json.dumps(body)
-            def call():
-                return self.session.post(self.endpoint + path, auth=self.auth, data=request_body, timeout=self.timeout,
+            def call(timeout):
+                return self.session.post(self.endpoint + path, auth=self.auth, data=request_body, timeout=timeout,
                                          verify=self.ssl_verify, headers=extra_headers)
         else:
             if not delete:
-                def call():
-                    return self.session.get(self.endpoint + path, auth=self.auth, timeout=self.timeout,
+                def call(timeout):
+                    return self.session.get(self.endpoint + path, auth=self.auth, timeout=timeout,
                                             verify=self.ssl_verify, headers=extra_headers)
             else:
-                def call():
-                    return self.session.delete(self.endpoint + path, auth=self.auth, timeout=self.timeout,
+                def call(timeout):
+                    return self.session.delete(self.endpoint + path, auth=self.auth, timeout=timeout,
                                                verify=self.ssl_verify, headers=extra_headers)
+        return call
 
-        start_time = time()
+    def _attempt_call(self, call, num_attempts, timeout, retry_codes=(), batch=False):
+        """
+        Make one attempt at a call, classifying the response.
+        :param retry_codes: HTTP status codes to treat as failed attempts (that may be retried)
+          rather than errors, besides those that always are (see APIResult.timeout_codes)
+        :param batch: whether the call executes a batch of actions (only those are timed for the batch_sizer)
+        :return: tuple (requests.result or None, APIResult)
+        """
+        batch_sizer = self.batch_sizer if batch else None
         result = None
-        for num_attempts in range(1, self.retry_max_attempts + 1):
-            checked_result = None
-            try:
-                result = call()
-                checked_result = APIResult(result).check_result()
-            except requests.Timeout:
-                self.logger.warning("UMAPI connection timeout...(%d seconds on try %d)",
-                               self.timeout, num_attempts)
-                checked_result = APIResult(success=False, timeout=0)
-            except requests.ConnectionError:
-                self.logger.warning("UMAPI connection error...(%d seconds on try %d)",
-                               self.timeout, num_attempts)
-                checked_result = APIResult(success=False, timeout=0)
-            
+        started = monotonic()
+        try:
+            result = call(timeout)
+            if result.status_code == 401 and self._token_rejected(result):
+                started = monotonic()
+                result = call(timeout)
+            checked_result = APIResult(result).check_result(retry_codes)
+        except requests.Timeout:
+            self.logger.warning("UMAPI connection timeout...(%d seconds on try %d)",
+                           self.timeout, num_attempts)
+            checked_result = APIResult(success=False, timeout=0)
+        except requests.ConnectionError:
+            self.logger.warning("UMAPI connection error...(%d seconds on try %d)",
+                           self.timeout, num_attempts)
+            checked_result = APIResult(success=False, timeout=0)
+        except ServerError:
+            if self.circuit_breaker:
+                self.circuit_breaker.record_failure()
+            if batch_sizer:
+                batch_sizer.record_response(monotonic() - started, False)
+            raise
+        except (RequestError, ClientError):
+            # the server is up, even if it didn't like the request
+            if self.circuit_breaker:
+                self.circuit_breaker.record_success()
+            if batch_sizer:
+                batch_sizer.record_response(monotonic() - started, True)
+            raise
+        except Exception:
+            # anything else (e.g., we couldn't get an auth token) means the call didn't work
+            if self.circuit_breaker:
+                self.circuit_breaker.record_failure()
+            raise
+        if batch_sizer:
+            batch_sizer.record_response(monotonic() - started, checked_result.success)
+        if self.circuit_breaker:
             if checked_result.success:
-                return result
-
+                self.circuit_breaker.record_success()
+            elif checked_result.status_code in self.circuit_breaker.neutral_codes:
+                self.circuit_breaker.record_neutral()
+            else:
+                self.circuit_breaker.record_failure()
+        if not checked_result.success:
             self.logger.warning("UMAPI request limit reached (code %s on try %d)",
                            checked_result.status_code, num_attempts)
+            if self.rate_limiter and checked_result.timeout > 0:
+                # the server told us when to come back, so hold off all other callers, too
+                self.rate_limiter.pause(checked_result.timeout)
+        return result, checked_result
 
-            retry_wait = checked_result.timeout
-            if retry_wait <= 0:
-                # use exponential back-off with random delay
-                delay = randint(0, self.retry_random_delay)
-                retry_wait = (int(pow(2, num_attempts - 1)) * self.retry_first_delay) + delay
+    def _token_rejected(self, result):
+        """
+        Handle a 401 response by dropping the auth token it was sent with.
+        :return: whether the call should be retried (with a new token)
+        """
+        invalidate = getattr(self.auth, "invalidate_token", None)
+        if invalidate is None:
+            return False
+        request = getattr(result, "request", None)
+        header = request.headers.get("Authorization", "") if request is not None else ""
+        self.logger.warning("UMAPI rejected the auth token...refreshing it and trying again")
+        invalidate(header[len("Bearer "):] if header.startswith("Bearer ") else None)
+        return True
 
-            if num_attempts < self.retry_max_attempts:
-                if retry_wait > 0:
-                    self.logger.warning("waiting %d seconds to continue...", retry_wait)
-                    sleep(retry_wait)
-                else:
-                    self.logger.warning("Immediate retry...")
-        total_time = int(time() - start_time)
+    def _retry_policy(self):
+        """
+        The retry policy for calls: either the one given, or one made from the
+        retry_* attributes of the connection.
+        """
+        if self.retry_policy:
+            return self.retry_policy
+        return RetryPolicy(max_attempts=self.retry_max_attempts,
+                           first_delay=self.retry_first_delay,
+                           random_delay=self.retry_random_delay)
+
+    def _next_retry_wait(self, policy, num_attempts, start_time, checked_result, retry_wait, deadline):
+        """
+        How long to wait before the next attempt, or None if we should give up.
+        """
+        if self._circuit_open():
+            return None
+        retry_wait = policy.next_delay(num_attempts, monotonic() - start_time, checked_result.status_code,
+                                       checked_result.timeout, retry_wait)
+        if retry_wait is not None and deadline is not None and monotonic() + retry_wait >= deadline:
+            self.logger.warning("UMAPI deadline would pass while waiting to retry...no more retries")
+            return None
+        return retry_wait
+
+    @staticmethod
+    def _is_throttled(checked_result):
+        return checked_result.status_code == 429 or (checked_result.timeout or 0) > 0
+
+    def _before_deadline(self, deadline):
+        if deadline is not None and monotonic() >= deadline:
+            self.logger.warning("UMAPI deadline reached...no more attempts")
+            return False
+        return True
+
+    def _attempt_timeout(self, deadline):
+        """
+        The request timeout for the next attempt: the connection's timeout, cut short by the deadline if any.
+        """
+        if deadline is None:
+            return self.timeout
+        remaining = max(deadline - monotonic(), 0.0)
+        return min(self.timeout, remaining) if self.timeout else remaining
+
+    def _circuit_open(self):
+        if self.circuit_breaker and self.circuit_breaker.is_open():
+            self.logger.warning("UMAPI circuit breaker is open...no more retries")
+            return True
+        return False
+
+    def _unavailable(self, start_time, num_attempts, checked_result):
+        total_time = int(monotonic() - start_time)
         self.logger.error("UMAPI timeout...giving up after %d attempts (%d seconds).",
-                     self.retry_max_attempts, total_time)
-        raise UnavailableError(self.retry_max_attempts, total_time, checked_result.result)
+                     num_attempts, total_time)
+        return UnavailableError(num_attempts, total_time, checked_result.result if checked_result else None)
+
+
+class AsyncConnection(Connection):
+    """
+    An asyncio version of Connection.  The query, execute and make_call methods are
+    coroutines that can be awaited from an event loop.  Each HTTP request runs on an
+    executor thread using the connection's pooled session, but waits between retries
+    are done with asyncio.sleep, so a call that is backing off holds no thread.
+    """
+
+    def __init__(self, *args, executor=None, **kwargs):
+        """
+        Takes all the parameters of Connection, plus:
+        :param executor: (optional) concurrent.futures.Executor for running HTTP requests;
+          the event loop's default executor is used if none is given.
+        """
+        if kwargs.get("linger"):
+            raise ArgumentError("An AsyncConnection can't linger: call execute_queued from the event loop instead")
+        super().__init__(*args, **kwargs)
+        self.executor = executor
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.close()
+            return
+        # don't hide the exception that is already on its way out
+        try:
+            await self.close()
+        except Exception as e:
+            self.logger.error("Failed to send queued actions on close: %s", e)
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' with an AsyncConnection")
+
+    async def close(self, deadline=None):
+        """
+        Send any queued actions and release the connection's pooled connections.  See Connection.close.
+        """
+        try:
+            return await self.execute_queued(deadline=deadline)
+        finally:
+            self._release()
+
+    async def query_single(self, object_type, url_params, query_params=None, deadline=None):
+        # type: (str, list, dict, float) -> dict
+        """
+        Query for a single object.  See Connection.query_single.
+        """
+        self.local_status["single-query-count"] += 1
+        query_path = self._single_query_path(object_type, url_params, query_params)
+        try:
+            result = await self.make_call(query_path, deadline=deadline)
+        except RequestError as re:
+            return self._single_query_not_found(re, object_type, url_params, query_params)
+        return self._single_query_value(result, object_type, url_params, query_params)
+
+    async def query_multiple(self, object_type, page=0, url_params=None, query_params=None, deadline=None):
+        # type: (str, int, list, dict, float) -> tuple
+        """
+        Query for a page of objects.  See Connection.query_multiple.
+        """
+        self.local_status["multiple-query-count"] += 1
+        query_path = self._multiple_query_path(object_type, page, url_params, query_params)
+        try:
+            result = await self.make_call(query_path, deadline=deadline)
+        except RequestError as re:
+            return self._multiple_query_not_found(re, object_type, url_params, query_params)
+        return self._multiple_query_values(result, object_type, page, url_params, query_params)
+
+    async def execute_single(self, action, immediate=False):
+        """
+        Execute a single action.  See Connection.execute_single.
+        """
+        return await self.execute_multiple([action], immediate=immediate)
+
+    async def execute_queued(self, deadline=None):
+        """
+        Force execute any queued commands.  See Connection.execute_queued.
+        """
+        return await self.execute_multiple([], immediate=True, deadline=deadline)
+
+    async def execute_multiple(self, actions, immediate=True, deadline=None):
+        """
+        Execute multiple Actions.  See Connection.execute_multiple.
+        """
+        self._queue_actions(actions)
+        batches = self._take_batches(immediate)
+        outcomes = await self._dispatch_batches(batches, deadline)
+        return self._record_execution(batches, outcomes)
+
+    async def execute_stream(self, actions, deadline=None):
+        """
+        Execute actions pulled lazily from an iterable, yielding a result for each batch.
+        This is an async generator.  See Connection.execute_stream.
+        """
+        source, pending, exhausted = iter(actions), self._take_queue(), False
+        try:
+            while pending or not exhausted:
+                pending, exhausted = self._fill_window(source, pending)
+                batches, pending = self._make_batches(pending, immediate=exhausted)
+                if not batches:
+                    continue
+                delay = self._stream_delay(deadline)
+                if delay is None:
+                    outcomes = self._missed_deadline(batches)
+                else:
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    outcomes = await self._dispatch_batches(batches, deadline)
+                results, pending = self._stream_results(batches, outcomes, pending)
+                for result in results:
+                    yield result
+        finally:
+            self._requeue(pending)
+
+    async def _dispatch_batches(self, batches, deadline=None):
+        """
+        Execute the batches, with up to max_in_flight of them in progress at once.
+        See Connection._dispatch_batches.
+        """
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+
+        async def execute(batch):
+            async with in_flight:
+                return await self._execute_batch(batch, deadline)
+
+        return await asyncio.gather(*[execute(batch) for batch in batches], return_exceptions=True)
+
+    async def _execute_batch(self, actions, deadline=None):
+        self._check_throttled()
+        try:
+            result = await self.make_call(self._batch_path(), [a.wire_dict() for a in actions], deadline=deadline,
+                                          raise_throttled=self.requeue_throttled, batch=True)
+        except ThrottledError as e:
+            self._defer_queue(e.retry_after)
+            raise
+        return self._batch_completed(actions, result)
+
+    async def make_call(self, path, body=None, delete=False, deadline=None, raise_throttled=False, batch=False):
+        """
+        Make a single UMAPI call with error handling and retry on temporary failure.
+        See Connection.make_call.
+        """
+        loop = asyncio.get_event_loop()
+        trial = False
+        if self.circuit_breaker:
+            # the breaker may need to probe the server's status, which blocks
+            trial = await loop.run_in_executor(self.executor, self.circuit_breaker.before_call, self)
+        try:
+            return await self._call_with_retries(self._prepare_call(path, body, delete), deadline, raise_throttled,
+                                                 batch)
+        finally:
+            if trial:
+                self.circuit_breaker.end_trial()
+
+    async def _call_with_retries(self, call, deadline, raise_throttled, batch=False):
+        """
+        Make attempts at a call until one succeeds or we have to give up.  See Connection._call_with_retries.
+        """
+        loop = asyncio.get_event_loop()
+        policy = self._retry_policy()
+        start_time = monotonic()
+        checked_result = retry_wait = None
+        num_attempts = 0
+        while self._before_deadline(deadline):
+            if self.rate_limiter:
+                await self.rate_limiter.acquire_async()
+            num_attempts += 1
+            result, checked_result = await loop.run_in_executor(self.executor, self._attempt_call, call,
+                                                                num_attempts, self._attempt_timeout(deadline),
+                                                                policy.retry_codes, batch)
+            if checked_result.success:
+                return result
+            retry_wait = self._next_retry_wait(policy, num_attempts, start_time, checked_result, retry_wait, deadline)
+            if raise_throttled and self._is_throttled(checked_result):
+                raise ThrottledError(retry_wait if retry_wait is not None else max(checked_result.timeout or 0, 0),
+                                     checked_result.result)
+            if retry_wait is None:
+                break
+            if retry_wait > 0:
+                self.logger.warning("waiting %d seconds to continue...", retry_wait)
+                await asyncio.sleep(retry_wait)
+            else:
+                self.logger.warning("Immediate retry...")
+        raise self._unavailable(start_time, num_attempts, checked_result)
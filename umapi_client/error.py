@@ -27,6 +27,21 @@ class UnavailableError(Exception):
         self.result = result
 
 
+class CircuitOpenError(UnavailableError):
+    def __init__(self, seconds):
+        Exception.__init__(self, "Server unavailable: Not calling for another {:d} seconds".format(seconds))
+        self.attempts = 0
+        self.seconds = seconds
+        self.result = None
+
+
+class ThrottledError(Exception):
+    def __init__(self, retry_after, result):
+        Exception.__init__(self, "Server throttled request: Retry after {:d} seconds".format(int(retry_after)))
+        self.retry_after = retry_after
+        self.result = result
+
+
 class ServerError(Exception):
     def __init__(self, result):
         Exception.__init__(self, "Server error ({}): ".format(result.status_code) + result.text)
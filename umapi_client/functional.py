@@ -176,18 +176,21 @@ class UsersQuery(QueryMultiple):
     Query for users meeting (optional) criteria
     """
 
-    def __init__(self, connection, in_group="", in_domain="", direct_only=True):
+    def __init__(self, connection, in_group="", in_domain="", direct_only=True, page_concurrency=1, read_ahead=0):
         """
         Create a query for all users, or for those in a group or domain or both
         :param connection: Connection to run the query against
         :param in_group: (optional) name of the group to restrict the query to
         :param in_domain: (optional) name of the domain to restrict the query to
+        :param page_concurrency: (optional) how many pages to fetch in parallel
+        :param read_ahead: (optional) how many pages to fetch in the background while iterating
         """
         groups = [in_group] if in_group else []
         params = {}
         if in_domain: params["domain"] = in_domain
         params["directOnly"] = direct_only
-        QueryMultiple.__init__(self, connection=connection, object_type="user", url_params=groups, query_params=params)
+        QueryMultiple.__init__(self, connection=connection, object_type="user", url_params=groups, query_params=params,
+                               page_concurrency=page_concurrency, read_ahead=read_ahead)
 
 
 class UserQuery(QuerySingle):
@@ -306,10 +309,175 @@ class GroupsQuery(QueryMultiple):
     Query for all groups
     """
 
-    def __init__(self, connection):
+    def __init__(self, connection, page_concurrency=1, read_ahead=0):
         """
         Create a query for all groups
         :param connection: Connection to run the query against
+        :param page_concurrency: (optional) how many pages to fetch in parallel
+        :param read_ahead: (optional) how many pages to fetch in the background while iterating
+        """
+        QueryMultiple.__init__(self, connection=connection, object_type="group", page_concurrency=page_concurrency,
+                               read_ahead=read_ahead)
+
+
+class MembershipChange:
+    """
+    A request, made to a MembershipPlanner, to add a user to some groups or remove them from some.
+    Once the planned actions have been executed, its errors can be fetched just like an Action's.
+    """
+
+    def __init__(self, user, domain, op, groups):
+        self.user = user
+        self.domain = domain
+        self.op = op
+        self.groups = list(groups)
+        self.errors = []
+
+    def __repr__(self):
+        return "MembershipChange " + str(self.__dict__)
+
+    def execution_errors(self):
+        """
+        Return the errors reported for the commands that carried out this change.
+        :return: list of dicts, each with the command, its target, and the error information
+        """
+        return [dict(e) for e in self.errors]
+
+
+class PlannedAction(Action):
+    """
+    An action made by a MembershipPlanner.  Each of its commands carries out (part of) one
+    or more MembershipChanges, and errors reported on a command are passed on to them.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # for each command, the MembershipChanges it carries out
+        self.changes = []
+
+    def add_command(self, op, list_type, names, changes):
+        self.commands.append({op: {list_type: list(names)}})
+        self.changes.append(changes)
+        return self
+
+    def report_command_error(self, error_dict):
+        super().report_command_error(error_dict)
+        error = self.errors[-1]
+        changes = self.changes[error_dict["step"]]
+        # errors on a group's user list may say which user they are about
+        named = [c for c in changes if error.get("user") == c.user]
+        for change in named or changes:
+            change.errors.append(dict(error))
+
+
+class MembershipPlanner:
+    """
+    Plans a set of group membership changes as the fewest actions (and so the fewest calls).
+    Each change can be sent either as a command on the user's action or as part of a user
+    list on the group's action.  Sending many users' changes to one group as a group action
+    takes far fewer actions than one user action per user, while a user's changes to
+    many small groups fit best on the user's action.  The planner chooses, group by group,
+    whichever gives fewer actions under the connection's throttle limits.
+    """
+
+    def __init__(self, connection):
+        """
+        :param connection: the Connection the actions will be executed on (for its throttle limits)
+        """
+        self.conn = connection
+        # (user, domain, group) -> (op, change); a later change to the same membership wins
+        self._memberships = {}
+
+    def add_to_groups(self, user, groups, domain=None):
+        """
+        Plan to add a user to groups.
+        :param user: the user's email (or username, if a domain is given)
+        :param groups: list of group names
+        :param domain: domain of a non-email username
+        :return: the MembershipChange, for fetching errors after execution
+        """
+        return self._change(user, domain, "add", groups)
+
+    def remove_from_groups(self, user, groups, domain=None):
+        """
+        Plan to remove a user from groups.  See add_to_groups.
         """
-        QueryMultiple.__init__(self, connection=connection, object_type="group")
+        return self._change(user, domain, "remove", groups)
 
+    def _change(self, user, domain, op, groups):
+        if '@' not in user and domain is None:
+            raise ArgumentError("Domain required for non-email username")
+        change = MembershipChange(user, domain, op, groups)
+        for group in change.groups:
+            self._memberships.pop((user, domain, group), None)
+            self._memberships[(user, domain, group)] = (op, change)
+        return change
+
+    def _action_count(self, adds, removes):
+        """
+        How many actions it takes to send the given number of list entries being added and removed.
+        """
+        list_size, max_commands = self.conn.throttle_groups, self.conn.throttle_commands
+        commands = -(-adds // list_size) + -(-removes // list_size)
+        return -(-commands // max_commands)
+
+    def plan(self):
+        """
+        Choose how to send the planned changes.
+        :return: the list of actions to execute (e.g., with Connection.execute_multiple)
+        """
+        by_user, by_group = {}, {}
+        for (user, domain, group), (op, change) in self._memberships.items():
+            by_user.setdefault((user, domain), []).append((op, group, change))
+            by_group.setdefault(group, []).append((op, (user, domain), change))
+        user_counts = {user: [sum(1 for op, _, _ in entries if op == op_type) for op_type in ("add", "remove")]
+                       for user, entries in by_user.items()}
+        group_centric = set()
+        # the biggest groups save the most actions, so consider them first
+        for group, entries in sorted(by_group.items(), key=lambda item: -len(item[1])):
+            # group user lists are by email, so users given by username stay on their own actions
+            if any(domain is not None for _, (_, domain), _ in entries):
+                continue
+            moved = {}
+            for op, user, _ in entries:
+                counts = moved.setdefault(user, list(user_counts[user]))
+                counts[0 if op == "add" else 1] -= 1
+            saving = sum(self._action_count(*user_counts[user]) - self._action_count(*counts)
+                         for user, counts in moved.items())
+            cost = self._action_count(sum(1 for op, _, _ in entries if op == "add"),
+                                      sum(1 for op, _, _ in entries if op == "remove"))
+            if cost < saving:
+                group_centric.add(group)
+                user_counts.update(moved)
+        actions = []
+        for (user, domain), entries in by_user.items():
+            entries = [entry for entry in entries if entry[1] not in group_centric]
+            frame = {"user": user} if domain is None else {"user": user, "domain": domain}
+            actions += self._make_actions(frame, "group", entries)
+        for group in [group for group in by_group if group in group_centric]:
+            entries = [(op, user, change) for op, (user, _), change in by_group[group]]
+            actions += self._make_actions({"usergroup": group}, "user", entries)
+        return actions
+
+    def _make_actions(self, frame, list_type, entries):
+        """
+        Build the actions on one object that carry out the given changes.
+        :param frame: the frame of the actions
+        :param list_type: the type of name in the command lists ("group" or "user")
+        :param entries: list of tuples (op, name, change)
+        :return: list of PlannedActions
+        """
+        list_size, max_commands = self.conn.throttle_groups, self.conn.throttle_commands
+        actions = []
+        for op_type in ("add", "remove"):
+            op_entries = [(name, change) for op, name, change in entries if op == op_type]
+            for start in range(0, len(op_entries), list_size):
+                chunk = op_entries[start:start + list_size]
+                if not actions or len(actions[-1].commands) >= max_commands:
+                    actions.append(PlannedAction(**frame))
+                changes = []
+                for _, change in chunk:
+                    if change not in changes:
+                        changes.append(change)
+                actions[-1].add_command(op_type, list_type, [name for name, _ in chunk], changes)
+        return actions
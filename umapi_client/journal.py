@@ -0,0 +1,176 @@
+# Copyright (c) 2016-2021 Adobe Inc.  All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+import os
+import threading
+import weakref
+
+from .api import Action
+
+logger = logging.getLogger(__name__)
+
+
+class ActionJournal:
+    """
+    A write-ahead journal of the actions given to a connection, kept in an append-only
+    file of JSON lines.  Actions are recorded when they are queued, and marked done once
+    the server has responded to the batch they were sent in.  If the process dies, a
+    connection given the same journal can resume() the actions that weren't done.
+    (Batches that never got an answer from the server, for example because it was unavailable
+    or a call timed out, aren't marked done, so on resume they may be sent a second time.)
+    """
+
+    def __init__(self, path, sync=True):
+        """
+        Open the journal, creating the file if need be.
+        :param path: the journal file
+        :param sync: whether to fsync the file after each write (slower, but survives power loss)
+        """
+        self.path = path
+        self.sync = sync
+        self._lock = threading.Lock()
+        # the journal id of each action we have recorded
+        self._ids = weakref.WeakKeyDictionary()
+        # the steps of each action that have been done as part of coalesced actions
+        self._done_steps = weakref.WeakKeyDictionary()
+        # id -> wire dict of the actions that aren't done
+        self._pending = {}
+        # ids of the pending actions read from the file, which haven't been resumed yet
+        self._unresumed = []
+        self._next_id = 0
+        self._load()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        """
+        Read the actions that weren't done from an existing journal, and rewrite it with just those.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be torn if the process died while writing it
+                    logger.warning("Skipping unreadable journal entry in %s", self.path)
+                    continue
+                if "queued" in entry:
+                    self._pending[entry["queued"]] = entry["action"]
+                    self._next_id = max(self._next_id, entry["queued"] + 1)
+                else:
+                    for action_id in entry.get("done", []):
+                        self._pending.pop(action_id, None)
+        self._unresumed = sorted(self._pending)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for action_id, wire_dict in self._pending.items():
+                f.write(json.dumps({"queued": action_id, "action": wire_dict}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def _write(self, entries):
+        for entry in entries:
+            self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    def record_queued(self, actions):
+        """
+        Record actions that have been given to the connection.  Actions already recorded are skipped.
+        :param actions: list of Action objects
+        """
+        entries = []
+        with self._lock:
+            for action in actions:
+                if action in self._ids:
+                    continue
+                self._ids[action] = action_id = self._next_id
+                self._next_id += 1
+                self._pending[action_id] = wire_dict = action.wire_dict()
+                entries.append({"queued": action_id, "action": wire_dict})
+            if entries:
+                self._write(entries)
+
+    def record_done(self, actions):
+        """
+        Mark the actions in a batch as done.
+        :param actions: the list of Action objects in the batch (a coalesced action counts for the actions
+          its commands came from, each of which is done once all of its commands have been sent)
+        """
+        with self._lock:
+            done = []
+            for action in self._finished(actions):
+                action_id = self._ids.get(action)
+                if action_id is not None and self._pending.pop(action_id, None) is not None:
+                    done.append(action_id)
+            if not done:
+                return
+            if self._pending:
+                self._write([{"done": done}])
+            else:
+                # nothing is outstanding, so the journal can start over
+                self._file.seek(0)
+                self._file.truncate()
+                self._write([])
+
+    def _finished(self, actions):
+        for action in actions:
+            sources = getattr(action, "sources", None)
+            if sources is None:
+                yield action
+                continue
+            # the commands of a source action may have been split across coalesced actions
+            for source, step in sources:
+                steps = self._done_steps.setdefault(source, set())
+                steps.add(step)
+                if len(steps) == len(source.commands):
+                    del self._done_steps[source]
+                    yield source
+
+    def pending_actions(self):
+        """
+        Rebuild the actions that were read from the journal file but aren't done.
+        (Actions recorded since the journal was opened are still with the connection that
+        queued them.)  Each action is only returned once.
+        :return: list of Action objects, in the order they were queued
+        """
+        with self._lock:
+            actions = []
+            unresumed, self._unresumed = self._unresumed, []
+            for action_id in unresumed:
+                wire_dict = self._pending.get(action_id)
+                if wire_dict is None:
+                    continue
+                frame = dict(wire_dict)
+                commands = frame.pop("do", [])
+                action = Action(**frame)
+                action.commands = commands
+                self._ids[action] = action_id
+                actions.append(action)
+            return actions
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
@@ -0,0 +1,345 @@
+# Copyright (c) 2016-2021 Adobe Inc.  All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import logging
+import threading
+from random import randint, uniform
+from time import monotonic, sleep
+
+from .error import ArgumentError, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    A token-bucket limiter on calls to the UMAPI service, which can be shared by
+    any number of connections and threads.  Calls are paced to the configured
+    rate, and when any call is told to back off (by a Retry-After header),
+    all calls wait until the server's cooldown period is over.
+    """
+
+    def __init__(self, calls_per_second=None, burst=None):
+        """
+        :param calls_per_second: the sustained rate of calls allowed (None means no limit,
+          so calls only wait out server cooldowns)
+        :param burst: how many calls can be made at once after a quiet period (default: one second's worth)
+        """
+        self.rate = float(calls_per_second) if calls_per_second else None
+        self.capacity = float(burst) if burst else max(self.rate or 1.0, 1.0)
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Claim the right to make a call.
+        :return: how many seconds the caller must wait before making the call.
+        """
+        with self._lock:
+            now = monotonic()
+            wait = 0.0
+            if self.rate:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = -self._tokens / self.rate
+            return max(wait, self._paused_until - now)
+
+    def cooldown(self):
+        """
+        :return: how many seconds remain before the server will take calls again.
+        """
+        with self._lock:
+            return max(self._paused_until - monotonic(), 0.0)
+
+    def pause(self, seconds):
+        """
+        Stop all calls for the given number of seconds (or until an earlier, longer pause ends).
+        :param seconds: the server's advised wait
+        """
+        with self._lock:
+            paused_until = monotonic() + seconds
+            if paused_until > self._paused_until:
+                logger.info("Pausing calls for %d seconds", seconds)
+                self._paused_until = paused_until
+
+    def acquire(self):
+        """
+        Wait (blocking the thread) until a call can be made.
+        """
+        wait = self.reserve()
+        while wait > 0:
+            sleep(wait)
+            wait = self.cooldown()
+
+    async def acquire_async(self):
+        """
+        Wait (without blocking the event loop) until a call can be made.
+        """
+        wait = self.reserve()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.cooldown()
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker on calls to the UMAPI service.  After enough consecutive failures
+    (timeouts, connection errors, or server errors), the circuit opens and calls fail
+    immediately with a CircuitOpenError instead of going through their retries.  Once the
+    reset timeout has passed, the next call probes the server's /status endpoint, and if the
+    server is live that call is let through as a trial: its success closes the circuit and
+    its failure opens it again.  Like a RateLimiter, a breaker can be shared by connections.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    # throttling responses show the server is up, so they don't count either way
+    neutral_codes = (429,)
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        """
+        :param failure_threshold: how many consecutive failures open the circuit
+        :param reset_timeout: how many seconds to wait, once open, before probing the server
+        """
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        return self.state == self.OPEN
+
+    def before_call(self, connection):
+        """
+        Check whether a call can go ahead, probing the server if it's time.
+        :param connection: the Connection making the call (used for the status probe)
+        :return: whether the call is a trial (in which case end_trial must be called once it is done);
+          raise CircuitOpenError if the call can't go ahead
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            remaining = self._opened_at + self.reset_timeout - monotonic()
+            if self.state == self.OPEN and remaining > 0:
+                raise CircuitOpenError(int(remaining + 1))
+            if self._trial_in_progress:
+                raise CircuitOpenError(0)
+            self._trial_in_progress = True
+        if self._probe(connection):
+            logger.info("UMAPI server is live...letting a trial call through")
+            with self._lock:
+                self.state = self.HALF_OPEN
+            return True
+        with self._lock:
+            self._trip()
+            self._trial_in_progress = False
+        raise CircuitOpenError(int(self.reset_timeout))
+
+    @staticmethod
+    def _probe(connection):
+        _, server_status = connection.status(remote=True)
+        return server_status.get("state") == "LIVE"
+
+    def end_trial(self):
+        """
+        Note that a trial call is over.  If it ended without its outcome being recorded (e.g., its
+        deadline passed before it was attempted), the next call can be the trial instead.
+        """
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("UMAPI call succeeded...closing the circuit")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_in_progress = False
+
+    def record_neutral(self):
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._trip()
+            self._trial_in_progress = False
+
+    def _trip(self):
+        if self.state != self.OPEN:
+            logger.warning("UMAPI circuit breaker opened after %d failures", self._failures)
+        self.state = self.OPEN
+        self._opened_at = monotonic()
+
+
+class RetryPolicy:
+    """
+    How a connection retries calls that time out or are throttled: how many attempts
+    to make, how long to wait between them, and which responses are worth retrying.
+    """
+    # back-off strategies
+    EXPONENTIAL = "exponential"    # first_delay doubling on each retry, plus up to random_delay seconds
+    FULL_JITTER = "full-jitter"    # anywhere from zero up to the exponential delay
+    DECORRELATED = "decorrelated"  # between first_delay and three times the previous delay
+
+    def __init__(self, max_attempts=4, first_delay=15, random_delay=5, backoff=EXPONENTIAL,
+                 max_delay=None, max_elapsed=None, retry_codes=(429, 502, 503, 504),
+                 retry_connection_errors=True, honor_retry_after=True):
+        """
+        :param max_attempts: how many times to try a call in all
+        :param first_delay: the base delay (in seconds) before the first retry
+        :param random_delay: the most random delay (in seconds) to add with exponential back-off
+        :param backoff: one of EXPONENTIAL, FULL_JITTER or DECORRELATED
+        :param max_delay: (optional) the longest back-off delay (in seconds) between attempts
+        :param max_elapsed: (optional) the most seconds to spend on a call, including waits
+        :param retry_codes: the HTTP status codes that should be retried (these may include codes,
+          such as 500, that would otherwise fail a call at once)
+        :param retry_connection_errors: whether to retry calls that time out or fail to connect
+        :param honor_retry_after: whether to wait for as long as the server says to, if it says
+        """
+        if backoff not in (self.EXPONENTIAL, self.FULL_JITTER, self.DECORRELATED):
+            raise ArgumentError("Unknown back-off strategy: {}".format(backoff))
+        self.max_attempts = max_attempts
+        self.first_delay = first_delay
+        self.random_delay = random_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.retry_codes = tuple(retry_codes)
+        self.retry_connection_errors = retry_connection_errors
+        self.honor_retry_after = honor_retry_after
+
+    def next_delay(self, num_attempts, elapsed, status_code, advised=0, previous=None):
+        """
+        Decide whether to retry a failed attempt, and if so how long to wait first.
+        :param num_attempts: how many attempts have been made so far
+        :param elapsed: how many seconds have been spent on the call so far
+        :param status_code: the HTTP status of the failed attempt ('Error' if there was no response)
+        :param advised: the wait (in seconds) advised by the server's Retry-After header, if any
+        :param previous: the wait before the failed attempt, if any
+        :return: the number of seconds to wait, or None if the call should not be retried
+        """
+        if num_attempts >= self.max_attempts:
+            return None
+        if status_code == 'Error':
+            if not self.retry_connection_errors:
+                return None
+        elif status_code not in self.retry_codes:
+            return None
+        if advised and advised > 0 and self.honor_retry_after:
+            delay = advised
+        else:
+            delay = self._backoff(num_attempts, previous)
+        if self.max_elapsed is not None and elapsed + delay > self.max_elapsed:
+            return None
+        return delay
+
+    def _backoff(self, num_attempts, previous):
+        exponential = int(pow(2, num_attempts - 1)) * self.first_delay
+        if self.backoff == self.FULL_JITTER:
+            delay = uniform(0, exponential)
+        elif self.backoff == self.DECORRELATED:
+            delay = uniform(self.first_delay, max(previous or self.first_delay, self.first_delay) * 3)
+        else:
+            delay = exponential + randint(0, self.random_delay)
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        return delay
+
+
+class BatchSizer:
+    """
+    Adapts the number of actions sent in each batch to how the server is responding,
+    by additive increase and multiplicative decrease.  Each full batch that succeeds
+    grows the batch size by one step, while each throttled, failed, or slow response
+    shrinks it by a factor (at most once per hold period, so that a burst of bad
+    responses to calls made at the same time counts as one signal).
+    """
+
+    def __init__(self, min_size=1, max_size=10, initial_size=None, increase=1, decrease=0.5,
+                 slow_seconds=None, hold_seconds=5):
+        """
+        :param min_size: the smallest batch size to shrink to
+        :param max_size: the largest batch size to grow to
+        :param initial_size: the starting batch size (default: max_size)
+        :param increase: how many actions to add after a full batch succeeds
+        :param decrease: the factor to shrink by after a bad response
+        :param slow_seconds: responses slower than this count as bad (None means latency doesn't matter)
+        :param hold_seconds: how long after shrinking to ignore further bad responses
+        """
+        if not 1 <= min_size <= max_size:
+            raise ArgumentError("Batch size bounds must satisfy 1 <= min_size <= max_size")
+        if not 0 < decrease < 1:
+            raise ArgumentError("Batch size decrease must be between 0 and 1")
+        self.min_size = int(min_size)
+        self.max_size = int(max_size)
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_seconds = slow_seconds
+        self.hold_seconds = hold_seconds
+        self._size = float(min(max(initial_size or self.max_size, self.min_size), self.max_size))
+        self._shrunk_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """
+        The number of actions to send in the next batch.
+        """
+        return int(self._size)
+
+    def record_response(self, seconds, healthy):
+        """
+        Note a response from the server.
+        :param seconds: how long the call took
+        :param healthy: False if the call was throttled, failed on the server, or timed out
+        """
+        if healthy and (self.slow_seconds is None or seconds <= self.slow_seconds):
+            return
+        with self._lock:
+            now = monotonic()
+            if self._shrunk_at is not None and now - self._shrunk_at < self.hold_seconds:
+                return
+            self._shrunk_at = now
+            size = max(self._size * self.decrease, self.min_size)
+            if int(size) < int(self._size):
+                logger.info("Reducing batch size to %d actions", int(size))
+            self._size = size
+
+    def record_batch(self, num_actions):
+        """
+        Note that a batch was executed successfully.
+        :param num_actions: the number of actions in the batch
+        """
+        with self._lock:
+            # only batches that used the whole size show the size can grow
+            if num_actions >= self.size:
+                self._size = min(self._size + self.increase, self.max_size)